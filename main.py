@@ -2,13 +2,22 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 from datetime import datetime, timedelta
+import codecs
+import io
 import os
 
+try:
+    import python_calamine  # noqa: F401
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
 # --- 页面基础设置 ---
 st.set_page_config(
     page_title="房产市场数据分析看板",
@@ -18,46 +27,107 @@ st.set_page_config(
 )
 
 # --- 辅助函数 ---
-def read_data_file(file):
-    """读取数据文件，支持CSV和Excel格式"""
+CSV_CHUNK_ROWS = 200_000
+
+DECODE_BLOCK_BYTES = 1 << 20
+
+def detect_encoding(file_bytes):
+    """按 UTF-8、GBK 的顺序逐块试解码整个文件，只解码不解析；都失败时使用 latin-1
+
+    UTF-8 解码器能处理 BOM，因此不必单独尝试 utf-8-sig。
+    """
+    data = memoryview(file_bytes)
+    for encoding in ('utf-8', 'gbk'):
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            for start in range(0, len(data), DECODE_BLOCK_BYTES):
+                decoder.decode(data[start:start + DECODE_BLOCK_BYTES])
+            decoder.decode(b'', final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1'
+
+def read_csv_in_chunks(file_bytes, encoding):
+    """分块读取CSV，每块先把价格和面积的 float64 列降为 float32 再合并，降低大文件解析时的内存峰值"""
+    chunks = []
+    for chunk in pd.read_csv(io.BytesIO(file_bytes), encoding=encoding, chunksize=CSV_CHUNK_ROWS):
+        float_cols = [
+            col for col in chunk.select_dtypes(include='float64').columns
+            if col in FLOAT32_SOURCE_COLUMNS
+        ]
+        if len(float_cols) > 0:
+            chunk[float_cols] = chunk[float_cols].astype(np.float32)
+        chunks.append(chunk)
+    return pd.concat(chunks, ignore_index=True)
+
+def read_csv_file(file_bytes, encoding):
+    """优先用 PyArrow 多线程解析CSV，表头不规范或类型推断失败时退回 pandas 分块读取"""
     try:
-        file_name = file.name.lower()
+        table = pacsv.read_csv(
+            io.BytesIO(file_bytes),
+            read_options=pacsv.ReadOptions(encoding=encoding),
+            convert_options=pacsv.ConvertOptions(strings_can_be_null=True)
+        )
+    except pa.ArrowInvalid:
+        return read_csv_in_chunks(file_bytes, encoding)
+    
+    # 编码不对时 PyArrow 不会报错，而是把文本读成二进制列，按解码失败处理
+    if any(pa.types.is_binary(t) for t in table.schema.types) or any('\ufffd' in name for name in table.column_names):
+        raise UnicodeDecodeError(encoding, file_bytes[:1], 0, 1, 'invalid text data')
+    
+    # 空列名和重复列名交给 pandas 处理（生成 Unnamed 列名、重复列加后缀）
+    if '' in table.column_names or len(set(table.column_names)) < len(table.column_names):
+        return read_csv_in_chunks(file_bytes, encoding)
+    
+    # 在 Arrow 端把价格和面积的 float64 列降为 float32，再逐列转换并释放 Arrow 内存
+    schema = pa.schema([
+        field.with_type(pa.float32())
+        if pa.types.is_float64(field.type) and field.name in FLOAT32_SOURCE_COLUMNS else field
+        for field in table.schema
+    ])
+    return table.cast(schema).to_pandas(date_as_object=False, split_blocks=True, self_destruct=True)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def read_data_file(file_name, file_bytes):
+    """读取数据文件，支持CSV和Excel格式
+
+    按单个文件的内容缓存，增减上传文件时已解析过的文件不会重新读取。
+    """
+    try:
+        display_name = file_name
+        file_name = file_name.lower()
         
         if file_name.endswith('.csv'):
-            # 尝试不同的编码格式读取CSV
-            try:
-                df = pd.read_csv(file, encoding='utf-8')
-            except UnicodeDecodeError:
-                try:
-                    df = pd.read_csv(file, encoding='gbk')
-                except UnicodeDecodeError:
-                    try:
-                        df = pd.read_csv(file, encoding='utf-8-sig')
-                    except UnicodeDecodeError:
-                        df = pd.read_csv(file, encoding='latin-1')
+            # 先确定编码再只解析一次
+            df = read_csv_file(file_bytes, encoding=detect_encoding(file_bytes))
         
         elif file_name.endswith(('.xlsx', '.xls')):
             # 读取Excel文件
-            engine = 'openpyxl' if file_name.endswith('.xlsx') else 'xlrd'
+            # 装有 python-calamine 时用 Rust 实现的 calamine 引擎，否则按格式使用 openpyxl / xlrd
+            if HAS_CALAMINE:
+                engine = 'calamine'
+            else:
+                engine = 'openpyxl' if file_name.endswith('.xlsx') else 'xlrd'
             
             # 首先检查工作表
             try:
-                excel_file = pd.ExcelFile(file, engine=engine)
+                excel_file = pd.ExcelFile(io.BytesIO(file_bytes), engine=engine)
                 sheet_names = excel_file.sheet_names
                 
                 # 如果有多个工作表，默认读取第一个，但可以在侧边栏选择
                 if len(sheet_names) > 1:
-                    st.sidebar.info(f"📊 {file.name} 包含 {len(sheet_names)} 个工作表")
+                    st.sidebar.info(f"📊 {display_name} 包含 {len(sheet_names)} 个工作表")
                     # 这里可以扩展为让用户选择工作表，暂时使用第一个
                     selected_sheet = sheet_names[0]
                 else:
                     selected_sheet = sheet_names[0] if sheet_names else 0
                 
-                df = pd.read_excel(file, sheet_name=selected_sheet, engine=engine)
+                df = pd.read_excel(excel_file, sheet_name=selected_sheet)
                 
             except Exception as e:
                 # 如果读取失败，尝试默认方式
-                df = pd.read_excel(file, engine=engine)
+                df = pd.read_excel(io.BytesIO(file_bytes), engine=engine)
         
         else:
             st.error(f"不支持的文件格式: {file_name}")
@@ -69,7 +139,8 @@ def read_data_file(file):
             df = df.dropna(how='all').dropna(axis=1, how='all')
             
             # 如果第一行看起来像标题行，确保它被用作列名
-            if df.columns.dtype == 'object' and any(df.columns.str.contains('Unnamed', na=False)):
+            # pandas 生成的占位列名都以 Unnamed 开头，直接逐个判断前缀，不走正则
+            if any(isinstance(col, str) and col.startswith('Unnamed') for col in df.columns):
                 # 可能需要重新设置列名
                 if not df.iloc[0].isna().all():
                     df.columns = df.iloc[0]
@@ -78,64 +149,91 @@ def read_data_file(file):
         return df
     
     except Exception as e:
-        st.error(f"读取文件 {file.name} 时出错: {str(e)}")
+        st.error(f"读取文件 {display_name} 时出错: {str(e)}")
         st.error("请确保文件格式正确，且包含有效的数据")
         return None
 
+# 各数据类型的列名映射规则：标准列名 -> 按优先级排列的候选列名
+COLUMN_MAPPING_RULES = {
+    '在售房源': {
+        '小区名称': ['小区', '楼盘', '项目名称', '楼盘名称', '小区名', '项目'],
+        '面积(㎡)': ['建筑面积(㎡)', '建筑面积', '面积', '房屋面积', '建面', '建筑面积（㎡）', '建筑面积(平米)', '面积(平米)'],
+        '总价(万)': ['总价(万)', '总价', '房屋总价', '总价（万）', '总价(万元)', '价格(万)', '售价(万)'],
+        '单价(元/平)': ['单价(元/平)', '单价', '房屋单价', '单价（元/平）', '单价(元/㎡)', '单价元/平', '均价'],
+        '建成年代': ['年代', '建成年份', '建造年代', '房龄', '建筑年代', '竣工年份'],
+        '户型': ['户型', '房型', '房间格局', '格局'],
+        '朝向': ['朝向', '房屋朝向', '方向'],
+        '楼层': ['楼层', '楼层信息', '所在楼层', '层数'],
+        '装修': ['装修', '装修情况', '装修状况', '装修程度'],
+        '关注人数': ['关注人数', '关注数', '浏览量', '关注量']
+    },
+    '成交房源': {
+        '总价(万)': ['成交总价(万)', '成交价格(万)', '成交总价', '总价(万)', '总价', '成交价(万)'],
+        '单价(元/平)': ['成交单价(元/平)', '成交单价', '单价(元/平)', '单价', '成交均价'],
+        '成交日期': ['成交日期', '成交时间', '交易日期', '签约日期'],
+        '成交周期(天)': ['成交周期(天)', '成交周期', '交易周期', '销售周期'],
+        '挂牌价(万)': ['挂牌价(万)', '挂牌价', '原价(万)', '标价(万)'],
+        '面积(㎡)': ['建筑面积(㎡)', '建筑面积', '面积', '房屋面积', '建面'],
+        '小区名称': ['小区', '楼盘', '项目名称', '楼盘名称', '小区名', '项目'],
+        '户型': ['户型', '房型', '房间格局', '格局'],
+    }
+}
+
+# 反向查找表：候选列名 -> (标准列名, 优先级)，模块加载时构建一次
+COLUMN_ALIASES = {
+    data_type: {
+        alias: (standard_name, priority)
+        for standard_name, possible_names in rules.items()
+        for priority, alias in enumerate(possible_names)
+    }
+    for data_type, rules in COLUMN_MAPPING_RULES.items()
+}
+
+# 读取时即可降为 float32 的价格和面积列（含全部候选列名），其余浮点列保持 float64，避免编号、坐标等丢失精度
+FLOAT32_COLUMNS = ('面积(㎡)', '总价(万)', '单价(元/平)', '挂牌价(万)')
+FLOAT32_SOURCE_COLUMNS = frozenset(FLOAT32_COLUMNS).union(
+    alias
+    for rules in COLUMN_MAPPING_RULES.values()
+    for standard_name, possible_names in rules.items() if standard_name in FLOAT32_COLUMNS
+    for alias in possible_names
+)
+
 def standardize_column_names(df, data_type):
-    """智能标准化列名"""
+    """智能标准化列名，返回标准化后的数据和实际应用的列名映射"""
     if df is None or df.empty:
-        return df
-    
-    # 创建列名映射字典
-    column_mappings = {}
-    
-    if data_type == '在售房源':
-        # 在售房源的列名映射规则
-        mapping_rules = {
-            '小区名称': ['小区', '楼盘', '项目名称', '楼盘名称', '小区名', '项目'],
-            '面积(㎡)': ['建筑面积(㎡)', '建筑面积', '面积', '房屋面积', '建面', '建筑面积（㎡）', '建筑面积(平米)', '面积(平米)'],
-            '总价(万)': ['总价(万)', '总价', '房屋总价', '总价（万）', '总价(万元)', '价格(万)', '售价(万)'],
-            '单价(元/平)': ['单价(元/平)', '单价', '房屋单价', '单价（元/平）', '单价(元/㎡)', '单价元/平', '均价'],
-            '建成年代': ['年代', '建成年份', '建造年代', '房龄', '建筑年代', '竣工年份'],
-            '小区名称': ['小区', '楼盘', '项目名称', '楼盘名称', '小区名', '项目'],
-            '户型': ['户型', '房型', '房间格局', '格局'],
-            '朝向': ['朝向', '房屋朝向', '方向'],
-            '楼层': ['楼层', '楼层信息', '所在楼层', '层数'],
-            '装修': ['装修', '装修情况', '装修状况', '装修程度'],
-            '关注人数': ['关注人数', '关注数', '浏览量', '关注量']
-        }
-    else:
-        # 成交房源的列名映射规则
-        mapping_rules = {
-            '总价(万)': ['成交总价(万)', '成交价格(万)', '成交总价', '总价(万)', '总价', '成交价(万)'],
-            '单价(元/平)': ['成交单价(元/平)', '成交单价', '单价(元/平)', '单价', '成交均价'],
-            '成交日期': ['成交日期', '成交时间', '交易日期', '签约日期'],
-            '成交周期(天)': ['成交周期(天)', '成交周期', '交易周期', '销售周期'],
-            '挂牌价(万)': ['挂牌价(万)', '挂牌价', '原价(万)', '标价(万)'],
-            '面积(㎡)': ['建筑面积(㎡)', '建筑面积', '面积', '房屋面积', '建面'],
-            '小区名称': ['小区', '楼盘', '项目名称', '楼盘名称', '小区名', '项目'],
-            '户型': ['户型', '房型', '房间格局', '格局'],
-        }
-    
-    # 执行列名映射
-    for standard_name, possible_names in mapping_rules.items():
-        for possible_name in possible_names:
-            if possible_name in df.columns and standard_name not in df.columns:
-                column_mappings[possible_name] = standard_name
-                break
+        return df, {}
+    
+    # 遍历一次现有列名，在反向查找表中找到对应的标准列名；同一标准列名有多个候选时取优先级最高的
+    rule_type = '在售房源' if data_type == '在售房源' else '成交房源'
+    aliases = COLUMN_ALIASES[rule_type]
+    existing_columns = set(df.columns)
+    best_matches = {}
+    for col in df.columns:
+        if col in aliases:
+            standard_name, priority = aliases[col]
+            if standard_name not in existing_columns and priority < best_matches.get(standard_name, (None, len(aliases)))[1]:
+                best_matches[standard_name] = (col, priority)
+    
+    # 按规则顺序生成实际应用的列名映射
+    column_mappings = {
+        best_matches[standard_name][0]: standard_name
+        for standard_name in COLUMN_MAPPING_RULES[rule_type]
+        if standard_name in best_matches
+    }
     
     # 应用映射
     if column_mappings:
         df = df.rename(columns=column_mappings)
-        
-        # 在侧边栏显示映射信息
-        if column_mappings:
-            with st.sidebar.expander("🔄 列名标准化"):
-                for old_name, new_name in column_mappings.items():
-                    st.write(f"• {old_name} → {new_name}")
     
-    return df
+    return df, column_mappings
+
+# 数值列的有效范围：(下限, 上限, 闭合方式, 异常描述)，上限为 None 时取当前年份
+VALID_RANGES = {
+    '总价(万)': (0, 50000, 'right', '异常价格值'),
+    '单价(元/平)': (0, 500000, 'right', '异常单价值'),
+    '面积(㎡)': (0, 1000, 'right', '异常面积值'),
+    '建成年代': (1900, None, 'both', '异常年代值')
+}
 
 def clean_and_validate_data(df, data_type):
     """数据清洗和质量验证"""
@@ -150,24 +248,22 @@ def clean_and_validate_data(df, data_type):
     if df is None or df.empty:
         return df, quality_report
     
-    # 删除完全空白的行
-    df_before = len(df)
-    df = df.dropna(how='all')
-    empty_rows_removed = df_before - len(df)
-    if empty_rows_removed > 0:
-        quality_report['issues'].append(f"删除了 {empty_rows_removed} 行空白数据")
+    # 完全空白的行和列已在 read_data_file 中删除，这里不再重复扫描整表
     
-    # 数值列处理
+    # 数值列处理：转换、范围验证和降精度都在同一个局部序列上完成，每列只写回一次
     numeric_cols = ['总价(万)', '单价(元/平)', '面积(㎡)', '建成年代', '挂牌价(万)', '成交周期(天)', '关注人数']
+    # 价格面积用 float32，年代、周期、人数尽量用小整数类型（含空值时退回 float32）
+    integer_cols = ['建成年代', '成交周期(天)', '关注人数']
     
     for col in numeric_cols:
         if col in df.columns:
             original_count = df[col].notna().sum()
             
             # 尝试转换为数值
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+            values = pd.to_numeric(df[col], errors='coerce')
+            valid = values.notna()
             
-            converted_count = df[col].notna().sum()
+            converted_count = valid.sum()
             missing_count = len(df) - converted_count
             
             quality_report['numeric_conversions'][col] = {
@@ -177,54 +273,387 @@ def clean_and_validate_data(df, data_type):
                 'missing_rate': missing_count / len(df) * 100
             }
             
-            # 数据范围验证
-            if col == '总价(万)' and converted_count > 0:
-                invalid_prices = df[(df[col] <= 0) | (df[col] > 50000)].index
-                if len(invalid_prices) > 0:
-                    df.loc[invalid_prices, col] = np.nan
-                    quality_report['issues'].append(f"{col}: 发现 {len(invalid_prices)} 个异常价格值")
-            
-            elif col == '单价(元/平)' and converted_count > 0:
-                invalid_unit_prices = df[(df[col] <= 0) | (df[col] > 500000)].index
-                if len(invalid_unit_prices) > 0:
-                    df.loc[invalid_unit_prices, col] = np.nan
-                    quality_report['issues'].append(f"{col}: 发现 {len(invalid_unit_prices)} 个异常单价值")
-            
-            elif col == '面积(㎡)' and converted_count > 0:
-                invalid_areas = df[(df[col] <= 0) | (df[col] > 1000)].index
-                if len(invalid_areas) > 0:
-                    df.loc[invalid_areas, col] = np.nan
-                    quality_report['issues'].append(f"{col}: 发现 {len(invalid_areas)} 个异常面积值")
-            
-            elif col == '建成年代' and converted_count > 0:
-                current_year = datetime.now().year
-                invalid_years = df[(df[col] < 1900) | (df[col] > current_year)].index
-                if len(invalid_years) > 0:
-                    df.loc[invalid_years, col] = np.nan
-                    quality_report['issues'].append(f"{col}: 发现 {len(invalid_years)} 个异常年代值")
+            # 数据范围验证：一次比较得到异常值掩码，再整列替换为空值
+            if col in VALID_RANGES and converted_count > 0:
+                low, high, inclusive, issue_name = VALID_RANGES[col]
+                if high is None:
+                    high = datetime.now().year
+                invalid = valid & ~values.between(low, high, inclusive=inclusive)
+                invalid_count = int(invalid.sum())
+                if invalid_count > 0:
+                    values = values.mask(invalid)
+                    quality_report['issues'].append(f"{col}: 发现 {invalid_count} 个{issue_name}")
+            
+            # 降精度存储
+            if col in integer_cols:
+                values = pd.to_numeric(values, downcast='integer')
+            if values.dtype == np.float64:
+                values = values.astype(np.float32)
+            
+            df[col] = values
+    
+    # 成交日期只在加载时解析一次，无法识别的日期记为空值
+    if '成交日期' in df.columns:
+        df['成交日期'] = pd.to_datetime(df['成交日期'], errors='coerce')
     
     # 文本列清理
     text_cols = ['小区名称', '户型', '朝向', '楼层', '装修']
     for col in text_cols:
         if col in df.columns:
-            # 去除前后空格
-            df[col] = df[col].astype(str).str.strip()
-            # 替换空字符串为NaN
-            df[col] = df[col].replace('', np.nan)
-            df[col] = df[col].replace('nan', np.nan)
+            values = df[col]
+            # 字符串类型的列可以直接去空格，混合类型的列先统一转为文本
+            if not isinstance(values.dtype, pd.StringDtype):
+                values = values.astype(str)
+            # 去除前后空格，并把空字符串和 'nan' 一次替换为空值
+            df[col] = values.str.strip().replace({'': np.nan, 'nan': np.nan})
     
     # 计算最终数据质量
     quality_report['cleaned_rows'] = len(df)
-    quality_report['data_completeness'] = {}
     
-    key_columns = ['小区名称', '总价(万)', '单价(元/平)', '面积(㎡)']
-    for col in key_columns:
-        if col in df.columns:
-            completeness = df[col].notna().sum() / len(df) * 100
-            quality_report['data_completeness'][col] = completeness
+    # 关键字段完整性：一次 notna().sum() 得到各列非空数
+    key_columns = [col for col in ['小区名称', '总价(万)', '单价(元/平)', '面积(㎡)'] if col in df.columns]
+    quality_report['data_completeness'] = df[key_columns].notna().sum().mul(100 / len(df)).to_dict()
     
     return df, quality_report
 
+def classify_room_types(huxing):
+    """提取户型主要类别（向量化，按1室到5室的优先级匹配）"""
+    huxing_str = huxing.astype(str)
+    conditions = [huxing.isna()] + [huxing_str.str.contains(f'{n}室', regex=False) for n in range(1, 6)]
+    choices = ['未知', '1室', '2室', '3室', '4室', '5室+']
+    return pd.Categorical(np.select(conditions, choices, default='其他'))
+
+def classify_floor_types(floor_info):
+    """提取楼层分类（向量化，按低、中、高楼层的优先级匹配）"""
+    floor_str = floor_info.astype(str)
+    conditions = [
+        floor_info.isna(),
+        floor_str.str.contains('低楼层|底层'),
+        floor_str.str.contains('中楼层|中层'),
+        floor_str.str.contains('高楼层|顶层')
+    ]
+    choices = ['未知', '低楼层', '中楼层', '高楼层']
+    return pd.Categorical(np.select(conditions, choices, default='其他'))
+
+def add_category_columns(df):
+    """添加筛选用的户型分类和楼层分类列，并将筛选列转换为分类类型"""
+    # 分类类型的 isin 筛选只比较整数编码
+    for col in ['区域', '商圈', '装修']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    
+    if '户型' in df.columns:
+        df['户型分类'] = classify_room_types(df['户型'])
+    
+    floor_col = '楼层信息' if '楼层信息' in df.columns else '楼层'
+    if floor_col in df.columns:
+        df['楼层分类'] = classify_floor_types(df[floor_col])
+    
+    # 取值重复度高的描述列也按分类存储，节省内存并加快等值比较和分组（分类列已按原文本派生完毕）
+    for col in ['小区名称', '户型', '朝向', floor_col]:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    
+    return df
+
+@st.cache_data(show_spinner="正在加载数据...", persist="disk", max_entries=16)
+def load_and_clean(files, data_type):
+    """读取、合并、标准化并清洗上传的数据文件
+
+    files 为 (文件名, 文件内容) 元组，按文件内容缓存，筛选器交互触发的重跑不会重新解析文件。
+    结果同时持久化到磁盘，服务重启或新会话上传相同文件时直接读取缓存。
+    """
+    df_list = []
+    file_info = []
+    
+    for file_name, file_bytes in files:
+        df_temp = read_data_file(file_name, file_bytes)
+        if df_temp is not None:
+            df_list.append(df_temp)
+            file_info.append({
+                'name': file_name,
+                'rows': len(df_temp),
+                'format': file_name.split('.')[-1].upper()
+            })
+    
+    if not df_list:
+        return None
+    
+    df = pd.concat(df_list, ignore_index=True)
+    
+    # 保留原始数据的前几行供预览
+    raw_preview = df.head(10)
+    raw_shape = df.shape
+    
+    # 智能列名标准化处理
+    df, column_mappings = standardize_column_names(df, data_type)
+    
+    # 数据质量检查和清洗
+    df, quality_report = clean_and_validate_data(df, data_type)
+    
+    # 派生筛选分类列
+    df = add_category_columns(df)
+    
+    # 一次聚合得到数值筛选滑块的取值范围，全为空的列不提供滑块
+    bounds_cols = [col for col in ['总价(万)', '面积(㎡)', '建成年代', '年代'] if col in df.columns]
+    column_bounds = {
+        col: (int(low), int(high))
+        for col, (low, high) in df[bounds_cols].agg(['min', 'max']).items()
+        if pd.notna(low)
+    }
+    
+    # 多选筛选器的选项：分类列的类别就是全部非空取值，无需在每次重跑时扫描整列
+    option_cols = [col for col in ['区域', '户型分类', '楼层分类', '装修'] if col in df.columns]
+    column_options = {col: sorted(df[col].cat.categories) for col in option_cols}
+    
+    # 各区域下的商圈，选择区域后直接合并得到可选商圈
+    district_circles = {}
+    if '区域' in df.columns and '商圈' in df.columns:
+        circles_by_district = df.dropna(subset=['商圈']).groupby('区域', observed=True)['商圈'].unique()
+        district_circles = {district: set(circles) for district, circles in circles_by_district.items()}
+    
+    return {
+        'df': df,
+        'file_info': file_info,
+        'raw_preview': raw_preview,
+        'raw_shape': raw_shape,
+        'column_mappings': column_mappings,
+        'quality_report': quality_report,
+        'column_bounds': column_bounds,
+        'column_options': column_options,
+        'district_circles': district_circles,
+        'decoration_has_nans': '装修' in df.columns and df['装修'].hasnans
+    }
+
+FILTER_KEY_PREFIX = 'flt_'
+
+def reset_filters():
+    """清除各筛选控件的会话状态，按钮回调结束后的这次重跑中控件即回到默认值"""
+    for key in [key for key in st.session_state if key.startswith(FILTER_KEY_PREFIX)]:
+        del st.session_state[key]
+
+# 记录当前筛选控件对应的数据集，键名不带筛选前缀，重置筛选时不会被清除
+DATASET_STATE_KEY = 'filter_dataset'
+
+def sync_filters_with_dataset(dataset_id):
+    """上传的数据或数据类型变化后清除筛选控件的会话状态，让各筛选回到新数据下的默认值"""
+    if st.session_state.get(DATASET_STATE_KEY) != dataset_id:
+        reset_filters()
+        st.session_state[DATASET_STATE_KEY] = dataset_id
+
+def reset_circle_filter():
+    """区域选择变化后商圈选项随之改变，清除已选商圈使其回到新区域下的全部商圈"""
+    st.session_state.pop(FILTER_KEY_PREFIX + '商圈', None)
+
+def add_selection_filter(filters, col, selected, options):
+    """添加多选筛选条件，全选时不添加，省去一次整列 isin 扫描"""
+    if len(selected) < len(options):
+        filters.append((col, selected))
+
+@st.cache_data(max_entries=8)
+def apply_filters(df, filters):
+    """按筛选条件过滤数据
+
+    filters 为 (列名, 条件) 元组：条件为列表时按取值筛选，为 (最小值, 最大值) 元组时按闭区间筛选。
+    所有条件在同一个布尔数组上原地合并，最后只切片一次。结果按数据和筛选条件缓存，拖动滑块产生的中间结果最多保留 8 组。
+    """
+    if not filters:
+        return df
+    
+    mask = np.ones(len(df), dtype=bool)
+    for col, condition in filters:
+        if isinstance(condition, tuple):
+            low, high = condition
+            values = df[col].to_numpy()
+            # 上下界分两次原地合并，不再生成两个比较结果再相与的临时数组
+            mask &= values >= low
+            mask &= values <= high
+        else:
+            mask &= df[col].isin(condition).to_numpy()
+    
+    return df[mask]
+
+@st.cache_data
+def add_time_columns(df):
+    """剔除无成交日期的记录，并添加整数时间键年月(YYYYMM)
+
+    整数键分组比 Period 快，显示时再格式化为文字标签。
+    """
+    # 成交日期已在加载时解析为日期类型，这里只按有效日期切片一次
+    deal_dates = df['成交日期']
+    valid = deal_dates.notna().to_numpy()
+    deal_dates = deal_dates[valid]
+    time_data = df[valid].assign(
+        年月=(deal_dates.dt.year * 100 + deal_dates.dt.month).astype('int32')
+    )
+    return time_data
+
+@st.cache_data
+def calculate_monthly_stats(time_data):
+    """按月统计成交量和价格，同时保留求和与计数，季度统计直接由月度结果再聚合
+
+    均值由同一次分组得到的求和与计数相除，分组只做计数、求和和中位数三类聚合。
+    """
+    value_cols = ['总价(万)', '单价(元/平)', '面积(㎡)', '成交周期(天)']
+    grouped = time_data[value_cols].astype(np.float64).groupby(time_data['年月'])
+    counts = grouped.count()
+    sums = grouped.sum()
+    medians = grouped[['总价(万)', '单价(元/平)']].median()
+    
+    return pd.DataFrame({
+        '成交量': counts['总价(万)'],
+        '平均总价': sums['总价(万)'] / counts['总价(万)'],
+        '中位总价': medians['总价(万)'],
+        '平均单价': sums['单价(元/平)'] / counts['单价(元/平)'],
+        '中位单价': medians['单价(元/平)'],
+        '平均面积': sums['面积(㎡)'] / counts['面积(㎡)'],
+        '平均成交周期': sums['成交周期(天)'] / counts['成交周期(天)'],
+        '总价合计': sums['总价(万)'],
+        '单价计数': counts['单价(元/平)'],
+        '单价合计': sums['单价(元/平)'],
+        '周期计数': counts['成交周期(天)'],
+        '周期合计': sums['成交周期(天)']
+    })
+
+def calculate_quarterly_stats(monthly_raw):
+    """由月度求和与计数再聚合出季度统计（季度键 YYYYQ）"""
+    quarter_keys = monthly_raw.index // 100 * 10 + (monthly_raw.index % 100 - 1) // 3 + 1
+    quarter_sums = monthly_raw.groupby(quarter_keys).sum()
+    quarterly_stats = pd.DataFrame({
+        '成交量': quarter_sums['成交量'],
+        '平均总价': quarter_sums['总价合计'] / quarter_sums['成交量'],
+        '平均单价': quarter_sums['单价合计'] / quarter_sums['单价计数'],
+        '平均成交周期': quarter_sums['周期合计'] / quarter_sums['周期计数']
+    }).round(2)
+    return quarterly_stats.rename_axis('季度').reset_index()
+
+@st.cache_data
+def detect_recent_trends(time_data):
+    """根据最近三个月的成交量和均价判断市场趋势
+
+    返回成交量趋势（1 上升、-1 下降、0 持平）和均价涨跌幅(%)，不足三个月时返回 None。
+    市场洞察和投资建议共用同一份结果。
+    """
+    # 只需要最近三个月：一次排序去重得到各月成交量，再只对这三个月的记录按月累加单价
+    month_keys = time_data['年月'].to_numpy()
+    months, month_counts = np.unique(month_keys, return_counts=True)
+    if len(months) < 3:
+        return None
+    
+    recent_months = months[-3:]
+    recent_rows = month_keys >= recent_months[0]
+    month_index = np.searchsorted(recent_months, month_keys[recent_rows])
+    unit_prices = time_data['单价(元/平)'].to_numpy(dtype=np.float64)[recent_rows]
+    has_price = ~np.isnan(unit_prices)
+    price_sums = np.bincount(month_index[has_price], weights=unit_prices[has_price], minlength=3)
+    price_counts = np.bincount(month_index[has_price], minlength=3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prices = price_sums / price_counts
+    
+    volumes = month_counts[-3:]
+    if volumes[-1] > volumes[0] * 1.2:
+        volume_trend = 1
+    elif volumes[-1] < volumes[0] * 0.8:
+        volume_trend = -1
+    else:
+        volume_trend = 0
+    
+    return {
+        'volume_trend': volume_trend,
+        'price_trend': (prices[-1] - prices[0]) / prices[0] * 100
+    }
+
+# 小区排行榜的统计列：输出列名 -> (源列, 聚合方式)
+COMMUNITY_AGGREGATIONS = {
+    '成交套数': ('总价(万)', 'count'),
+    '平均总价': ('总价(万)', 'mean'),
+    '总成交额': ('总价(万)', 'sum'),
+    '平均单价': ('单价(元/平)', 'mean'),
+    '平均面积': ('面积(㎡)', 'mean'),
+    '平均成交周期': ('成交周期(天)', 'mean')
+}
+
+@st.cache_data
+def calculate_community_stats(df):
+    """按小区统计成交套数、均价、总额、面积和成交周期，只保留成交不少于3套的小区
+
+    用命名聚合一次得到各统计列，数据中缺少的源列对应的统计列为空值。
+    """
+    aggregations = {name: spec for name, spec in COMMUNITY_AGGREGATIONS.items() if spec[0] in df.columns}
+    community_stats = df.groupby('小区名称', observed=True).agg(**aggregations)
+    community_stats = community_stats.reindex(columns=list(COMMUNITY_AGGREGATIONS)).reset_index()
+    
+    # 过滤掉成交套数少于3套的小区（避免数据不具代表性）
+    return community_stats[community_stats['成交套数'] >= 3]
+
+def top_n_positions(values, n, ascending=True):
+    """返回排序后前 n 名的行位置，空值排在最后
+
+    先用 argpartition 找到第 n 名的取值，取出不差于它的全部候选（含并列），
+    再只对候选稳定排序后截取前 n 个，并列时按原行序排列。
+    """
+    keys = np.asarray(values, dtype=np.float64)
+    keys = np.where(np.isnan(keys), np.inf, keys if ascending else -keys)
+    n = min(n, len(keys))
+    if n == 0:
+        return np.arange(0)
+    kth = keys[np.argpartition(keys, n - 1)[n - 1]]
+    candidates = np.flatnonzero(keys <= kth)
+    return candidates[np.argsort(keys[candidates], kind='stable')][:n]
+
+def calculate_change_rate(values):
+    """计算环比变化率(%)，首期为空；差值、相除和缩放都在同一个数组上完成"""
+    values = np.asarray(values, dtype=np.float64)
+    change = np.full(len(values), np.nan)
+    if len(values) > 1:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(np.subtract(values[1:], values[:-1]), values[:-1], out=change[1:])
+        change[1:] *= 100
+    return change
+
+@st.cache_data
+def calculate_cycle_distribution(cycle_days):
+    """统计各成交周期段的房源数量，无有效数据时返回 None"""
+    cycle_data = cycle_days.to_numpy(dtype=np.float64)
+    cycle_data = cycle_data[~np.isnan(cycle_data)]
+    if len(cycle_data) == 0:
+        return None
+    
+    # 右闭区间 (0,30]、(30,60]…，二分查找得到段号后直接计数，不构造分类数据；≤0 天不计入任何分段
+    cycle_edges = np.array([30, 60, 90, 180])
+    cycle_labels = ['快速成交(≤30天)', '正常成交(31-60天)', '缓慢成交(61-90天)', '困难成交(91-180天)', '超长周期(>180天)']
+    segment_ids = np.searchsorted(cycle_edges, cycle_data[cycle_data > 0], side='left')
+    counts = np.bincount(segment_ids, minlength=len(cycle_labels))
+    
+    cycle_dist = pd.DataFrame({'成交周期段': cycle_labels, '数量': counts})
+    return cycle_dist.sort_values('数量', ascending=False, kind='stable').reset_index(drop=True)
+
+def valid_numeric_values(df, columns):
+    """取出各数值列去掉空值后的数组，缺失的列和全为空的列不返回"""
+    valid = {}
+    for col in columns:
+        if col in df.columns:
+            values = df[col].to_numpy(dtype=np.float64)
+            values = values[~np.isnan(values)]
+            if len(values) > 0:
+                valid[col] = values
+    return valid
+
+@st.cache_data
+def calculate_discount_rates(price_data):
+    """计算成交折价率(%)数组，剔除挂牌价或成交总价缺失的记录"""
+    listing = price_data['挂牌价(万)'].to_numpy(dtype=np.float64)
+    deal = price_data['总价(万)'].to_numpy(dtype=np.float64)
+    valid = ~(np.isnan(listing) | np.isnan(deal))
+    listing = listing[valid]
+    
+    # 在同一个数组上原地相减、相除和缩放，不生成中间 Series
+    discount_rates = np.subtract(listing, deal[valid])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(discount_rates, listing, out=discount_rates)
+    discount_rates *= 100
+    return discount_rates
+
 def display_data_quality_report(quality_report):
     """显示数据质量报告"""
     st.sidebar.subheader("📊 数据质量报告")
@@ -258,20 +687,80 @@ def display_data_quality_report(quality_report):
     if not quality_report['issues']:
         st.sidebar.success("✅ 数据质量良好")
 
+@st.cache_data
+def calculate_overview_stats(df):
+    """核心指标卡片用到的各列均值和中位数，一次 agg 得到，按筛选后的数据缓存"""
+    cols = [col for col in ['总价(万)', '面积(㎡)', '成交周期(天)', '关注人数'] if col in df.columns]
+    return df[cols].agg(['mean', 'median'])
+
+@st.cache_data
 def calculate_price_per_sqm_stats(df, price_col, area_col):
     """计算单价统计信息"""
     if price_col in df.columns and area_col in df.columns:
-        valid_data = df.dropna(subset=[price_col, area_col])
-        if len(valid_data) > 0:
+        valid = df[price_col].notna().to_numpy() & df[area_col].notna().to_numpy()
+        prices = df[price_col].to_numpy(dtype=np.float64)[valid]
+        if len(prices) > 0:
+            # 一次排序得到三个分位数；标准差复用均值，与 pandas 一致使用样本标准差
+            q25, median, q75 = np.percentile(prices, [25, 50, 75])
+            mean = prices.mean()
+            deviations = prices - mean
+            std = np.sqrt(np.dot(deviations, deviations) / (len(prices) - 1)) if len(prices) > 1 else np.nan
             return {
-                'mean': valid_data[price_col].mean(),
-                'median': valid_data[price_col].median(),
-                'std': valid_data[price_col].std(),
-                'q25': valid_data[price_col].quantile(0.25),
-                'q75': valid_data[price_col].quantile(0.75)
+                'mean': mean,
+                'median': median,
+                'std': std,
+                'cv': std / mean,
+                'q25': q25,
+                'q75': q75
             }
     return None
 
+def segment_by_bins(values, bins, labels):
+    """按右闭区间 (bins[i-1], bins[i]] 分段，结果与 pd.cut 一致但不构造区间对象，超出范围或缺失的值为空"""
+    codes = np.digitize(values, bins, right=True) - 1
+    codes[codes >= len(labels)] = -1
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+def summarize_segments(segments, values, name):
+    """按分段统计数量、均值和中位数，结果与 groupby(observed=True).agg(['count', 'mean', 'median']) 一致
+
+    计数和求和用 bincount，中位数在按（分段, 数值）排序后的数组里按段位置直接取，不经过 groupby。
+    """
+    segments = pd.Categorical(segments)
+    values = np.asarray(values, dtype=np.float64)
+    codes = segments.codes
+    in_segment = codes >= 0
+    codes, values = codes[in_segment], values[in_segment]
+    
+    n_segments = len(segments.categories)
+    counts = np.bincount(codes, minlength=n_segments)
+    sums = np.bincount(codes, weights=values, minlength=n_segments)
+    
+    sorted_values = values[np.lexsort((values, codes))]
+    starts = np.cumsum(counts) - counts
+    observed = counts > 0
+    counts, sums, starts = counts[observed], sums[observed], starts[observed]
+    medians = (sorted_values[starts + (counts - 1) // 2] + sorted_values[starts + counts // 2]) / 2
+    
+    index = pd.CategoricalIndex(segments.categories[observed], categories=segments.categories, name=name)
+    return pd.DataFrame({'count': counts, 'mean': sums / counts, 'median': medians}, index=index).round(2)
+
+@st.cache_data
+def analyze_age_price(df, year_col):
+    """按房龄段统计平均单价和套数，结果按筛选后的数据缓存，无有效数据时返回 None"""
+    year_data = df[[year_col, '单价(元/平)']].dropna()
+    if len(year_data) == 0:
+        return None
+    
+    ages = datetime.now().year - year_data[year_col].to_numpy(dtype=np.float64)
+    age_groups = segment_by_bins(ages, 
+                                 bins=[0, 5, 10, 20, 30, float('inf')], 
+                                 labels=['新房(≤5年)', '次新房(6-10年)', '中等房龄(11-20年)', '老房(21-30年)', '超老房(>30年)'])
+    
+    age_price = year_data['单价(元/平)'].groupby(age_groups, observed=True).agg(['mean', 'count'])
+    return age_price.rename_axis('房龄段').reset_index()
+
+@st.cache_data
 def analyze_market_segments(df, price_col, area_col):
     """市场细分分析"""
     segments = {}
@@ -279,9 +768,9 @@ def analyze_market_segments(df, price_col, area_col):
         valid_data = df.dropna(subset=[price_col, area_col])
         if len(valid_data) > 0:
             # 按面积分段
-            valid_data['面积段'] = pd.cut(valid_data[area_col], 
-                                      bins=[0, 50, 70, 90, 120, float('inf')], 
-                                      labels=['小户型(<50㎡)', '紧凑型(50-70㎡)', '标准型(70-90㎡)', '舒适型(90-120㎡)', '大户型(>120㎡)'])
+            valid_data['面积段'] = segment_by_bins(valid_data[area_col].to_numpy(), 
+                                                bins=[0, 50, 70, 90, 120, float('inf')], 
+                                                labels=['小户型(<50㎡)', '紧凑型(50-70㎡)', '标准型(70-90㎡)', '舒适型(90-120㎡)', '大户型(>120㎡)'])
             
             # 按总价分段 - 修复重复边界问题
             try:
@@ -303,17 +792,16 @@ def analyze_market_segments(df, price_col, area_col):
                         # 如果价格范围为0，创建一个简单的两段分类
                         bins = [min_price - 0.1, min_price, min_price + 0.1]
                         labels = ['经济型', '中端型']
-                        valid_data['价格段'] = pd.cut(valid_data[price_col], bins=bins, labels=labels)
-                        segments['price_segments'] = valid_data.groupby('价格段', observed=True)[area_col].agg(['count', 'mean', 'median']).round(2)
-                        segments['area_segments'] = valid_data.groupby('面积段', observed=True)[price_col].agg(['count', 'mean', 'median']).round(2)
-                        segments['data'] = valid_data
+                        valid_data['价格段'] = segment_by_bins(valid_data[price_col].to_numpy(), bins=bins, labels=labels)
+                        segments['price_segments'] = summarize_segments(valid_data['价格段'], valid_data[area_col], '价格段')
+                        segments['area_segments'] = summarize_segments(valid_data['面积段'], valid_data[price_col], '面积段')
                         return segments
                 else:
                     bins = [0, q1, q3, float('inf')]
                 
-                valid_data['价格段'] = pd.cut(valid_data[price_col], 
-                                          bins=bins, 
-                                          labels=['经济型', '中端型', '高端型'])
+                valid_data['价格段'] = segment_by_bins(valid_data[price_col].to_numpy(), 
+                                                    bins=bins, 
+                                                    labels=['经济型', '中端型', '高端型'])
             except Exception as e:
                 # 如果分段失败，使用简单的三等分
                 try:
@@ -324,9 +812,9 @@ def analyze_market_segments(df, price_col, area_col):
                     if price_range > 0:
                         third = price_range / 3
                         bins = [min_price, min_price + third, min_price + 2*third, max_price + 0.1]
-                        valid_data['价格段'] = pd.cut(valid_data[price_col], 
-                                              bins=bins, 
-                                              labels=['经济型', '中端型', '高端型'])
+                        valid_data['价格段'] = segment_by_bins(valid_data[price_col].to_numpy(), 
+                                                        bins=bins, 
+                                                        labels=['经济型', '中端型', '高端型'])
                     else:
                         # 如果所有价格相同，只创建一个类别
                         valid_data['价格段'] = '中端型'
@@ -334,9 +822,8 @@ def analyze_market_segments(df, price_col, area_col):
                     # 最后的备选方案：跳过价格分段
                     valid_data['价格段'] = '未分类'
             
-            segments['area_segments'] = valid_data.groupby('面积段', observed=True)[price_col].agg(['count', 'mean', 'median']).round(2)
-            segments['price_segments'] = valid_data.groupby('价格段', observed=True)[area_col].agg(['count', 'mean', 'median']).round(2)
-            segments['data'] = valid_data
+            segments['area_segments'] = summarize_segments(valid_data['面积段'], valid_data[price_col], '面积段')
+            segments['price_segments'] = summarize_segments(valid_data['价格段'], valid_data[area_col], '价格段')
     return segments
 
 def analyze_property_competitiveness(selected_property, all_properties):
@@ -366,30 +853,25 @@ def analyze_property_competitiveness(selected_property, all_properties):
     return analysis
 
 def filter_competitors(selected_property, all_properties):
-    """筛选竞争对手房源"""
-    # 排除自己
-    competitors = all_properties[all_properties.index != selected_property.name].copy()
-    
-    # 筛选条件：同户型或相近面积
+    """筛选竞争对手房源：同户型或面积相近（±20%），同户型的排在前面"""
     target_area = selected_property['建筑面积(㎡)']
     target_rooms = selected_property['户型']
     
+    # 排除自己
+    not_self = all_properties.index.to_numpy() != selected_property.name
+    
     # 面积范围：±20%
+    area = all_properties['建筑面积(㎡)'].to_numpy(dtype=np.float64, na_value=np.nan)
     area_range = target_area * 0.2
-    area_filter = (competitors['建筑面积(㎡)'] >= target_area - area_range) & \
-                  (competitors['建筑面积(㎡)'] <= target_area + area_range)
+    area_ok = (area >= target_area - area_range) & (area <= target_area + area_range)
     
-    # 户型匹配或面积相近
-    room_filter = competitors['户型'] == target_rooms
+    room_ok = (all_properties['户型'] == target_rooms).to_numpy(dtype=bool)
     
-    # 组合筛选：同户型优先，否则选择面积相近的
-    same_room_competitors = competitors[room_filter]
-    similar_area_competitors = competitors[area_filter & ~room_filter]
+    # 一个掩码取出候选，再按"是否同户型"稳定排序，不再拼接和整行去重
+    positions = np.flatnonzero(not_self & (room_ok | area_ok))
+    positions = positions[np.argsort(~room_ok[positions], kind='stable')]
     
-    # 合并结果，同户型的排在前面
-    final_competitors = pd.concat([same_room_competitors, similar_area_competitors]).drop_duplicates()
-    
-    return final_competitors
+    return all_properties.iloc[positions]
 
 def analyze_price_competitiveness(selected_property, competitors):
     """分析价格竞争力"""
@@ -397,18 +879,18 @@ def analyze_price_competitiveness(selected_property, competitors):
         return {"rank": "无竞争对手", "percentile": 100}
     
     target_price = selected_property['单价(元/平)']
-    competitor_prices = competitors['单价(元/平)'].dropna()
+    competitor_prices = valid_numeric_values(competitors, ['单价(元/平)']).get('单价(元/平)')
     
-    if len(competitor_prices) == 0:
+    if competitor_prices is None:
         return {"rank": "无价格数据", "percentile": 50}
     
-    # 计算价格排名（价格越低排名越好）
-    lower_count = len(competitor_prices[competitor_prices > target_price])
+    # 计算价格排名（价格越低排名越好），直接在数组上计数，不再切出子序列
+    lower_count = np.count_nonzero(competitor_prices > target_price)
     total_count = len(competitor_prices) + 1  # 包括自己
     percentile = (lower_count + 1) / total_count * 100
     
     avg_price = competitor_prices.mean()
-    median_price = competitor_prices.median()
+    median_price = np.median(competitor_prices)
     
     return {
         "target_price": target_price,
@@ -427,17 +909,20 @@ def analyze_area_competitiveness(selected_property, competitors):
     target_area = selected_property['建筑面积(㎡)']
     target_total_price = selected_property['总价(万)']
     
-    competitor_data = competitors.dropna(subset=['建筑面积(㎡)', '总价(万)'])
+    # 面积和总价都有值的竞品才参与比较，直接在数组上去空值，不复制整表
+    competitor_areas = competitors['建筑面积(㎡)'].to_numpy(dtype=np.float64, na_value=np.nan)
+    competitor_prices = competitors['总价(万)'].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = ~(np.isnan(competitor_areas) | np.isnan(competitor_prices))
     
-    if len(competitor_data) == 0:
+    if not valid.any():
         return {"rank": "无面积数据"}
     
     # 计算性价比：面积/总价
     target_value_ratio = target_area / target_total_price
-    competitor_ratios = competitor_data['建筑面积(㎡)'] / competitor_data['总价(万)']
+    competitor_ratios = competitor_areas[valid] / competitor_prices[valid]
     
     # 排名（性价比越高排名越好）
-    better_count = len(competitor_ratios[competitor_ratios < target_value_ratio])
+    better_count = np.count_nonzero(competitor_ratios < target_value_ratio)
     total_count = len(competitor_ratios) + 1
     percentile = (better_count + 1) / total_count * 100
     
@@ -454,20 +939,20 @@ def analyze_attention_competitiveness(selected_property, competitors):
         return {"rank": "无关注度数据"}
     
     target_attention = selected_property['关注人数']
-    competitor_attention = competitors['关注人数'].dropna()
+    competitor_attention = valid_numeric_values(competitors, ['关注人数']).get('关注人数')
     
-    if len(competitor_attention) == 0:
+    if competitor_attention is None:
         return {"rank": "无关注度数据"}
     
     # 排名（关注度越高排名越好）
-    lower_count = len(competitor_attention[competitor_attention < target_attention])
+    lower_count = np.count_nonzero(competitor_attention < target_attention)
     total_count = len(competitor_attention) + 1
     percentile = (lower_count + 1) / total_count * 100
     
     return {
         "target_attention": target_attention,
         "avg_competitor_attention": competitor_attention.mean(),
-        "median_competitor_attention": competitor_attention.median(),
+        "median_competitor_attention": np.median(competitor_attention),
         "percentile": percentile,
         "rank": f"{lower_count + 1}/{total_count}"
     }
@@ -483,7 +968,7 @@ def analyze_feature_competitiveness(selected_property, competitors):
         features['south_facing'] = south_facing
         
         if len(competitors) > 0 and '朝向' in competitors.columns:
-            competitor_south = competitors['朝向'].apply(lambda x: '南' in str(x) if pd.notna(x) else False)
+            competitor_south = competitors['朝向'].str.contains('南', na=False, regex=False)
             south_ratio = competitor_south.mean() * 100
             features['south_facing_advantage'] = south_facing and south_ratio < 50
     
@@ -498,11 +983,12 @@ def analyze_feature_competitiveness(selected_property, competitors):
     
     # 房源标签分析
     if '房源标签' in selected_property and pd.notna(selected_property['房源标签']):
-        tags = str(selected_property['房源标签']).split('|')
-        features['tags'] = [tag.strip() for tag in tags]
-        features['has_metro'] = any('地铁' in tag for tag in tags)
-        features['has_vr'] = any('VR' in tag for tag in tags)
-        features['tax_advantage'] = any('满五' in tag for tag in tags)
+        tag_text = str(selected_property['房源标签'])
+        features['tags'] = [tag.strip() for tag in tag_text.split('|')]
+        # 关键词不含分隔符，直接在整串标签里查找即可，无需逐个标签遍历
+        features['has_metro'] = '地铁' in tag_text
+        features['has_vr'] = 'VR' in tag_text
+        features['tax_advantage'] = '满五' in tag_text
     
     return features
 
@@ -555,6 +1041,21 @@ def calculate_overall_competitiveness(analysis):
     
     return 50.0
 
+COMPARISON_BAR_COLORS = ['red', 'blue', 'green']
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def comparison_bar_figure(title, yaxis_title, labels, values, text_format):
+    """目标房源与竞争对手的对比柱状图，按标题和数值缓存，同一房源重跑时不再重新构建"""
+    fig = go.Figure(go.Bar(
+        x=list(labels),
+        y=list(values),
+        marker_color=COMPARISON_BAR_COLORS[:len(labels)],
+        text=[text_format.format(x) for x in values],
+        textposition='auto'
+    ))
+    fig.update_layout(title=title, yaxis_title=yaxis_title, height=300)
+    return fig
+
 def display_competitiveness_analysis(analysis, selected_property):
     """显示竞争力分析结果"""
     
@@ -613,24 +1114,13 @@ def display_competitiveness_analysis(analysis, selected_property):
             
             with col2:
                 # 价格对比图
-                fig_price = go.Figure()
-                
-                fig_price.add_trace(go.Bar(
-                    x=['目标房源', '竞争对手均价', '竞争对手中位价'],
-                    y=[price_analysis['target_price'], 
-                       price_analysis['avg_competitor_price'], 
-                       price_analysis['median_competitor_price']],
-                    marker_color=['red', 'blue', 'green'],
-                    text=[f"{x:,.0f}" for x in [price_analysis['target_price'], 
-                                               price_analysis['avg_competitor_price'], 
-                                               price_analysis['median_competitor_price']]],
-                    textposition='auto'
-                ))
-                
-                fig_price.update_layout(
-                    title="单价对比分析",
-                    yaxis_title="单价 (元/㎡)",
-                    height=300
+                fig_price = comparison_bar_figure(
+                    "单价对比分析", "单价 (元/㎡)",
+                    ('目标房源', '竞争对手均价', '竞争对手中位价'),
+                    (price_analysis['target_price'],
+                     price_analysis['avg_competitor_price'],
+                     price_analysis['median_competitor_price']),
+                    "{:,.0f}"
                 )
                 
                 st.plotly_chart(fig_price, use_container_width=True)
@@ -652,20 +1142,11 @@ def display_competitiveness_analysis(analysis, selected_property):
             
             with col2:
                 # 性价比对比
-                fig_ratio = go.Figure()
-                
-                fig_ratio.add_trace(go.Bar(
-                    x=['目标房源', '竞争对手均值'],
-                    y=[area_analysis['target_ratio'], area_analysis['avg_competitor_ratio']],
-                    marker_color=['red', 'blue'],
-                    text=[f"{x:.2f}" for x in [area_analysis['target_ratio'], area_analysis['avg_competitor_ratio']]],
-                    textposition='auto'
-                ))
-                
-                fig_ratio.update_layout(
-                    title="面积性价比对比 (㎡/万元)",
-                    yaxis_title="性价比 (㎡/万元)",
-                    height=300
+                fig_ratio = comparison_bar_figure(
+                    "面积性价比对比 (㎡/万元)", "性价比 (㎡/万元)",
+                    ('目标房源', '竞争对手均值'),
+                    (area_analysis['target_ratio'], area_analysis['avg_competitor_ratio']),
+                    "{:.2f}"
                 )
                 
                 st.plotly_chart(fig_ratio, use_container_width=True)
@@ -687,24 +1168,13 @@ def display_competitiveness_analysis(analysis, selected_property):
             
             with col2:
                 # 关注度对比
-                fig_attention = go.Figure()
-                
-                fig_attention.add_trace(go.Bar(
-                    x=['目标房源', '竞争对手均值', '竞争对手中位数'],
-                    y=[attention_analysis['target_attention'], 
-                       attention_analysis['avg_competitor_attention'], 
-                       attention_analysis['median_competitor_attention']],
-                    marker_color=['red', 'blue', 'green'],
-                    text=[f"{x:.0f}" for x in [attention_analysis['target_attention'], 
-                                              attention_analysis['avg_competitor_attention'], 
-                                              attention_analysis['median_competitor_attention']]],
-                    textposition='auto'
-                ))
-                
-                fig_attention.update_layout(
-                    title="关注度对比分析",
-                    yaxis_title="关注人数",
-                    height=300
+                fig_attention = comparison_bar_figure(
+                    "关注度对比分析", "关注人数",
+                    ('目标房源', '竞争对手均值', '竞争对手中位数'),
+                    (attention_analysis['target_attention'],
+                     attention_analysis['avg_competitor_attention'],
+                     attention_analysis['median_competitor_attention']),
+                    "{:.0f}"
                 )
                 
                 st.plotly_chart(fig_attention, use_container_width=True)
@@ -757,21 +1227,19 @@ def display_competitiveness_analysis(analysis, selected_property):
         display_count = min(10, len(competitors))
         top_competitors = competitors.head(display_count)
         
-        # 创建对比表格
-        comparison_data = []
-        for idx, competitor in top_competitors.iterrows():
-            comparison_data.append({
-                '小区': competitor['小区'],
-                '户型': competitor['户型'],
-                '面积(㎡)': competitor['建筑面积(㎡)'],
-                '总价(万)': competitor['总价(万)'],
-                '单价(元/㎡)': f"{competitor['单价(元/平)']:,.0f}",
-                '朝向': competitor['朝向'],
-                '楼层': competitor['楼层'],
-                '关注人数': competitor['关注人数']
-            })
-        
-        comparison_df = pd.DataFrame(comparison_data)
+        # 创建对比表格：整列选取并重命名，不逐行构造
+        comparison_columns = {
+            '小区': '小区',
+            '户型': '户型',
+            '建筑面积(㎡)': '面积(㎡)',
+            '总价(万)': '总价(万)',
+            '单价(元/平)': '单价(元/㎡)',
+            '朝向': '朝向',
+            '楼层': '楼层',
+            '关注人数': '关注人数'
+        }
+        comparison_df = top_competitors[list(comparison_columns)].rename(columns=comparison_columns).reset_index(drop=True)
+        comparison_df['单价(元/㎡)'] = comparison_df['单价(元/㎡)'].map('{:,.0f}'.format)
         st.dataframe(comparison_df, use_container_width=True)
         
         # 投资建议
@@ -816,6 +1284,430 @@ def display_competitiveness_analysis(analysis, selected_property):
         for rec in recommendations:
             st.write(rec)
 
+@st.cache_resource
+def segment_chart_layout():
+    """户型市场细分图的子图骨架，只含布局不含数据；使用时用 go.Figure() 复制后再添加数据"""
+    from plotly.subplots import make_subplots
+    
+    fig = make_subplots(
+        rows=1, cols=2,
+        subplot_titles=('房源数量分布', '平均总价对比'),
+        specs=[[{"secondary_y": False}, {"secondary_y": False}]]
+    )
+    fig.update_layout(height=400, showlegend=False)
+    fig.update_xaxes(tickangle=45)
+    return fig
+
+@st.cache_resource
+def volume_price_chart_layout():
+    """量价趋势图的子图骨架，只含布局不含数据；使用时用 go.Figure() 复制后再添加数据"""
+    from plotly.subplots import make_subplots
+    
+    fig = make_subplots(
+        rows=2, cols=1,
+        subplot_titles=('📊 月度成交量趋势', '💰 月度价格趋势'),
+        vertical_spacing=0.1,
+        specs=[[{"secondary_y": True}], [{"secondary_y": True}]]
+    )
+    fig.update_layout(
+        height=600,
+        title_text="🏠 房产市场量价趋势分析",
+        showlegend=True
+    )
+    fig.update_yaxes(title_text="成交套数", row=1, col=1)
+    fig.update_yaxes(title_text="单价 (元/㎡)", row=2, col=1)
+    fig.update_xaxes(title_text="时间", row=2, col=1)
+    return fig
+
+def price_box_figure(box_data, by_region):
+    """单价分布箱线图，按区域分组或整体展示
+
+    plotly.express 只有箱线图和散点图用到，调用时才导入，未上传文件时的首屏不必加载。
+    """
+    import plotly.express as px
+    
+    if by_region:
+        fig = px.box(box_data, x='区域', y='单价(元/平)', color='区域', points='outliers')
+        fig.update_layout(
+            title="各区域单价分布对比",
+            yaxis_title="单价 (元/㎡)",
+            showlegend=True
+        )
+    else:
+        fig = px.box(box_data, y='单价(元/平)', points='outliers')
+        fig.update_layout(
+            title="单价整体分布",
+            yaxis_title="单价 (元/㎡)"
+        )
+    return fig
+
+def area_price_scatter_figure(plot_data):
+    """面积-总价散点图，点的大小表示单价，有区域列时按区域着色"""
+    import plotly.express as px
+    
+    return px.scatter(
+        plot_data,
+        x='面积(㎡)',
+        y='总价(万)',
+        size='单价(元/平)',
+        color='区域' if '区域' in plot_data.columns else None,
+        hover_data=['小区名称', '户型'] if '小区名称' in plot_data.columns else None,
+        title="面积-总价-单价三维关系",
+        labels={'size': '单价(元/㎡)'},
+        render_mode='webgl'
+    )
+
+def to_csv_bytes(df):
+    """用 PyArrow 的 CSV 写出器导出数据，带 BOM 的 UTF-8 编码方便 Excel 直接识别中文
+
+    数字和文本混排的列无法转成 Arrow 表，此时退回 pandas 的 to_csv。
+    """
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return df.to_csv(index=False).encode('utf-8-sig')
+    
+    # 不含时刻的时间列按日期写出，避免导出 "2024-01-01 00:00:00.000"
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            column = table.column(i)
+            dates = pc.cast(column, pa.date32())
+            if pc.all(pc.equal(pc.cast(dates, field.type), column)).as_py() is not False:
+                table = table.set_column(i, field.name, dates)
+    
+    buffer = io.BytesIO()
+    buffer.write('\ufeff'.encode('utf-8'))
+    pacsv.write_csv(table, buffer)
+    return buffer.getvalue()
+
+# 单选某个户型、楼层或装修时对应的洞察与建议
+FLOOR_INSIGHTS = {
+    '高楼层': "🔸 高楼层房源通常视野好、采光佳，但价格相对较高",
+    '低楼层': "🔸 低楼层房源出行便利，适合老人居住，价格相对实惠",
+    '中楼层': "🔸 中楼层房源平衡了价格和居住体验，是热门选择"
+}
+DECORATION_INSIGHTS = {
+    '精装': "🔸 精装房源即买即住，但总价较高，适合追求便利的购房者",
+    '简装': "🔸 简装房源价格适中，可根据个人喜好再装修",
+    '毛坯': "🔸 毛坯房源价格最低，但需要额外装修成本和时间"
+}
+ROOM_RECOMMENDATIONS = {
+    '1室': "🔹 1室户型投资回报率高，适合出租给单身白领",
+    '2室': "🔹 2室户型需求稳定，适合小家庭和情侣租住",
+    '3室': "🔹 3室户型适合三口之家，保值性好，转手容易"
+}
+FLOOR_RECOMMENDATIONS = {
+    '高楼层': "🔹 高楼层房源溢价明显，但要注意电梯维护成本",
+    '低楼层': "🔹 低楼层房源性价比高，适合预算有限的首次购房者"
+}
+DECORATION_RECOMMENDATIONS = {
+    '毛坯': "🔹 毛坯房总价低，但需预留10-20万装修预算",
+    '精装': "🔹 精装房即买即住，适合工作繁忙的购房者"
+}
+
+# 明细表默认显示的关键列
+DETAIL_KEY_COLUMNS = {
+    '在售房源': ['小区名称', '户型', '面积(㎡)', '总价(万)', '单价(元/平)', '区域', '商圈', '朝向', '装修', '楼层'],
+    '成交房源': ['小区名称', '户型', '面积(㎡)', '总价(万)', '单价(元/平)', '成交日期', '成交周期(天)', '挂牌价(万)']
+}
+
+# 排行榜前三名的行底色：金、银、铜
+TOP3_HIGHLIGHTS = ['background-color: #FFD700', 'background-color: #C0C0C0', 'background-color: #CD7F32']
+
+@st.fragment
+def render_community_ranking(filtered_df):
+    """小区排行榜，作为局部片段运行：切换排序维度、数量或顺序时只重跑排行榜部分"""
+    # 排行榜控制选项
+    ranking_col1, ranking_col2, ranking_col3 = st.columns(3)
+    
+    with ranking_col1:
+        ranking_metric = st.selectbox(
+            "排序维度",
+            ["成交量", "成交均价", "成交总价", "成交周期"],
+            help="选择小区排行的评判标准"
+        )
+    
+    with ranking_col2:
+        top_n = st.selectbox(
+            "显示数量",
+            [10, 20, 30, 50],
+            help="选择显示排行榜前N名"
+        )
+    
+    with ranking_col3:
+        sort_order = st.selectbox(
+            "排序方式",
+            ["从高到低", "从低到高"],
+            help="选择排序顺序"
+        )
+    
+    # 计算小区统计数据
+    try:
+        # 小区聚合按筛选结果缓存，切换排序维度、数量和顺序时只重新排序
+        community_stats = calculate_community_stats(filtered_df)
+        
+        if len(community_stats) > 0:
+            # 根据选择的维度排序
+            if ranking_metric == "成交量":
+                sort_col = '成交套数'
+                metric_unit = '套'
+                metric_desc = '成交套数越多，说明小区越受欢迎'
+            elif ranking_metric == "成交均价":
+                if '平均单价' in community_stats.columns and community_stats['平均单价'].notna().any():
+                    sort_col = '平均单价'
+                    metric_unit = '元/㎡'
+                    metric_desc = '单价越高，说明小区品质和地段越好'
+                else:
+                    st.warning("当前数据中没有单价信息，改为按成交量排序")
+                    sort_col = '成交套数'
+                    metric_unit = '套'
+                    metric_desc = '成交套数越多，说明小区越受欢迎'
+            elif ranking_metric == "成交总价":
+                sort_col = '平均总价'
+                metric_unit = '万元'
+                metric_desc = '总价越高，说明小区房源价值越高'
+            elif ranking_metric == "成交周期":
+                if '平均成交周期' in community_stats.columns and community_stats['平均成交周期'].notna().any():
+                    sort_col = '平均成交周期'
+                    metric_unit = '天'
+                    metric_desc = '成交周期越短，说明小区房源越好卖'
+                else:
+                    st.warning("当前数据中没有成交周期信息，改为按成交量排序")
+                    sort_col = '成交套数'
+                    metric_unit = '套'
+                    metric_desc = '成交套数越多，说明小区越受欢迎'
+            
+            # 处理成交周期为空的情况
+            if sort_col == '平均成交周期' and community_stats['平均成交周期'].isna().all():
+                st.warning("成交周期数据不完整，改为按成交量排序")
+                sort_col = '成交套数'
+                metric_unit = '套'
+                metric_desc = '成交套数越多，说明小区越受欢迎'
+            
+            # 排序：只对前 top_n 名做部分排序
+            ascending = (sort_order == "从低到高")
+            if sort_col == '平均成交周期':
+                # 成交周期排序时，先过滤掉空值
+                valid_cycle_data = community_stats.dropna(subset=[sort_col])
+                if len(valid_cycle_data) > 0:
+                    community_ranking = valid_cycle_data.iloc[top_n_positions(valid_cycle_data[sort_col], top_n, ascending)]
+                else:
+                    st.warning("没有有效的成交周期数据")
+                    community_ranking = community_stats.iloc[top_n_positions(community_stats['成交套数'], top_n, ascending=False)]
+            else:
+                community_ranking = community_stats.iloc[top_n_positions(community_stats[sort_col], top_n, ascending)]
+            
+            # 显示排行榜
+            st.subheader(f"🏆 {ranking_metric}排行榜 TOP {top_n}")
+            st.caption(f"💡 {metric_desc}")
+            
+            # 创建排行榜可视化
+            fig_ranking = go.Figure()
+            
+            # 反转顺序让第一名在顶部，图上数值保留两位小数，标签在数组上整体格式化
+            ranking_names = community_ranking['小区名称'].to_numpy()[::-1]
+            ranking_values = np.round(community_ranking[sort_col].to_numpy(dtype=np.float64)[::-1], 2)
+            ranking_text = np.where(
+                np.isnan(ranking_values), 'N/A',
+                np.char.add(np.char.mod('%.0f', ranking_values), metric_unit)
+            )
+            
+            # 添加柱状图
+            fig_ranking.add_trace(go.Bar(
+                y=ranking_names,
+                x=ranking_values,
+                orientation='h',
+                text=ranking_text,
+                textposition='auto',
+                marker=dict(
+                    color=ranking_values,
+                    colorscale='Viridis',
+                    showscale=True,
+                    colorbar=dict(title=f"{ranking_metric}({metric_unit})")
+                )
+            ))
+            
+            fig_ranking.update_layout(
+                title=f"{ranking_metric}排行榜",
+                xaxis_title=f"{ranking_metric} ({metric_unit})",
+                yaxis_title="小区名称",
+                height=max(400, len(community_ranking) * 25),
+                showlegend=False
+            )
+            
+            st.plotly_chart(fig_ranking, use_container_width=True)
+            
+            # 显示详细排行榜表格
+            st.subheader("📋 详细排行榜数据")
+            
+            # 添加排名列
+            ranking_display = community_ranking.copy()
+            ranking_display.insert(0, '排名', range(1, len(ranking_display) + 1))
+            
+            # 格式化数值显示
+            if '平均单价' in ranking_display.columns:
+                ranking_display['平均单价'] = ranking_display['平均单价'].apply(lambda x: f"{x:,.0f}" if not pd.isna(x) else "N/A")
+            ranking_display['平均总价'] = ranking_display['平均总价'].apply(lambda x: f"{x:.1f}" if not pd.isna(x) else "N/A")
+            ranking_display['总成交额'] = ranking_display['总成交额'].apply(lambda x: f"{x:.1f}" if not pd.isna(x) else "N/A")
+            ranking_display['平均面积'] = ranking_display['平均面积'].apply(lambda x: f"{x:.1f}" if not pd.isna(x) else "N/A")
+            if '平均成交周期' in ranking_display.columns:
+                ranking_display['平均成交周期'] = ranking_display['平均成交周期'].apply(lambda x: f"{x:.0f}" if not pd.isna(x) else "N/A")
+            
+            # 重命名列以便显示
+            display_columns = {
+                '排名': '排名',
+                '小区名称': '小区名称',
+                '成交套数': '成交套数',
+                '平均单价': '平均单价(元/㎡)',
+                '平均总价': '平均总价(万)',
+                '总成交额': '总成交额(万)',
+                '平均面积': '平均面积(㎡)'
+            }
+            
+            if '平均成交周期' in ranking_display.columns:
+                display_columns['平均成交周期'] = '平均成交周期(天)'
+            
+            ranking_display = ranking_display.rename(columns=display_columns)
+            
+            # 高亮显示前三名：排名即行序，整表样式一次性铺好，不再逐行回调
+            row_styles = np.full(len(ranking_display), '', dtype=object)
+            top_count = min(len(TOP3_HIGHLIGHTS), len(row_styles))
+            row_styles[:top_count] = TOP3_HIGHLIGHTS[:top_count]
+            cell_styles = np.repeat(row_styles[:, None], ranking_display.shape[1], axis=1)
+            styled_ranking = ranking_display.style.apply(lambda _: cell_styles, axis=None)
+            st.dataframe(styled_ranking, use_container_width=True)
+            
+            # 排行榜洞察
+            st.subheader("💡 排行榜洞察")
+            
+            insights = []
+            
+            if len(community_ranking) > 0:
+                top1 = community_ranking.iloc[0]
+                top1_value = top1[sort_col]
+                
+                if ranking_metric == "成交量":
+                    insights.append(f"🥇 **{top1['小区名称']}** 以 **{top1_value:.0f}套** 成交量位居榜首，是最受欢迎的小区")
+                    if len(community_ranking) > 1:
+                        avg_volume = community_ranking['成交套数'].mean()
+                        insights.append(f"📊 榜单小区平均成交量为 **{avg_volume:.1f}套**，显示了活跃的交易市场")
+                
+                elif ranking_metric == "成交均价":
+                    insights.append(f"🥇 **{top1['小区名称']}** 以 **{top1_value:,.0f}元/㎡** 的均价位居榜首，是区域内的高端小区")
+                    if len(community_ranking) > 1:
+                        price_range = community_ranking['平均单价'].max() - community_ranking['平均单价'].min()
+                        insights.append(f"💰 榜单小区价格差距为 **{price_range:,.0f}元/㎡**，显示了明显的品质分层")
+                
+                elif ranking_metric == "成交总价":
+                    insights.append(f"🥇 **{top1['小区名称']}** 以 **{top1_value:.1f}万元** 的均价位居榜首，房源价值最高")
+                    avg_area = top1['平均面积']
+                    insights.append(f"🏠 该小区平均面积为 **{avg_area:.1f}㎡**，属于{'大户型' if avg_area > 100 else '中等户型' if avg_area > 70 else '小户型'}定位")
+                
+                elif ranking_metric == "成交周期" and not pd.isna(top1_value):
+                    insights.append(f"🥇 **{top1['小区名称']}** 以 **{top1_value:.0f}天** 的成交周期位居榜首，是最容易成交的小区")
+                    if top1_value <= 30:
+                        insights.append("⚡ 成交周期在30天以内，属于快速成交，说明房源非常抢手")
+                    elif top1_value <= 60:
+                        insights.append("✅ 成交周期在60天以内，属于正常成交速度")
+            
+            # 显示洞察
+            for insight in insights:
+                st.markdown(insight)
+            
+        else:
+            st.warning("没有足够的小区数据进行排行榜分析（需要至少3套成交记录）")
+            
+    except Exception as e:
+        st.error(f"小区排行榜分析出现错误: {str(e)}")
+
+@st.fragment
+def render_property_competitiveness(filtered_df):
+    """房源竞争力分析，作为局部片段运行：切换目标房源时只重跑竞争力部分"""
+    try:
+        # 房源选择器
+        st.subheader("🏠 选择目标房源")
+    
+        # 创建房源选择的显示格式：直接在各列的数组上拼接，不再逐行构造 Series 调用函数
+        label_cols = ['小区', '户型', '建筑面积(㎡)', '总价(万)', '单价(元/平)']
+        property_labels = [
+            f"{name} | {rooms} | {area:g}㎡ | {total:g}万 | {unit:,.0f}元/㎡"
+            for name, rooms, area, total, unit in zip(*(filtered_df[col].to_numpy() for col in label_cols))
+        ]
+        filtered_df['房源显示'] = property_labels
+        # 为每个房源创建唯一标识，即其在筛选结果中的位置
+        filtered_df['房源ID'] = np.arange(len(filtered_df), dtype=np.int32)
+    
+        # 房源选择下拉框：按位置直接取显示文字，不再为每个选项扫描整列
+        selected_property_idx = st.selectbox(
+            "选择要分析的房源：",
+            options=range(len(property_labels)),
+            format_func=lambda x: property_labels[x],
+            help="选择一套房源进行竞争力分析"
+        )
+    
+        if selected_property_idx is not None:
+            selected_property = filtered_df.iloc[selected_property_idx]
+        
+            # 显示选中房源的详细信息
+            st.subheader("📋 目标房源信息")
+        
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("🏢 小区", selected_property['小区'])
+                st.metric("🏠 户型", selected_property['户型'])
+            with col2:
+                st.metric("💰 总价", f"{selected_property['总价(万)']:g}万")
+                st.metric("🏷️ 单价", f"{selected_property['单价(元/平)']:,.0f}元/㎡")
+            with col3:
+                st.metric("📐 面积", f"{selected_property['建筑面积(㎡)']:g}㎡")
+                st.metric("🧭 朝向", selected_property['朝向'])
+            with col4:
+                st.metric("🏢 楼层", selected_property['楼层'])
+                st.metric("👥 关注度", f"{selected_property['关注人数']}人")
+        
+            # 房源标签展示
+            if '房源标签' in selected_property and pd.notna(selected_property['房源标签']):
+                st.write("🏷️ **房源标签：**", selected_property['房源标签'])
+        
+            # 竞争力分析
+            st.subheader("⚔️ 竞争力分析")
+        
+            # 定义竞争对手筛选条件
+            competitor_analysis = analyze_property_competitiveness(selected_property, filtered_df)
+        
+            # 显示竞争分析结果
+            display_competitiveness_analysis(competitor_analysis, selected_property)
+            
+    except Exception as e:
+        st.error(f"房源竞争力分析出现错误: {str(e)}")
+
+@st.fragment
+def render_detail_table(filtered_df, data_type):
+    """详细数据表格，作为局部片段运行：切换显示选项或导出时只重跑表格部分"""
+    # 数据表格选项
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        show_all_columns = st.checkbox("显示所有列", value=False)
+    with col2:
+        rows_to_show = st.selectbox("显示行数", [10, 25, 50, 100], index=1)
+    with col3:
+        if st.button("📥 导出数据"):
+            csv = to_csv_bytes(filtered_df)
+            st.download_button(
+                label="下载CSV文件",
+                data=csv,
+                file_name=f"{data_type}_分析数据_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv"
+            )
+    
+    # 显示数据表格
+    if show_all_columns:
+        st.dataframe(filtered_df.head(rows_to_show), use_container_width=True)
+    else:
+        # 选择关键列显示（列名索引按哈希查找），先取前几行再选列，避免复制整列
+        available_columns = [col for col in DETAIL_KEY_COLUMNS[data_type] if col in filtered_df.columns]
+        st.dataframe(filtered_df.head(rows_to_show)[available_columns], use_container_width=True)
+
 # --- 侧边栏控制面板 ---
 st.sidebar.title("🏢 房产市场分析控制台")
 st.sidebar.markdown("---")
@@ -838,25 +1730,22 @@ uploaded_files = st.sidebar.file_uploader(
 # --- 数据加载与处理 ---
 if uploaded_files:
     try:
-        # 读取所有上传的数据文件并合并
-        df_list = []
-        file_info = []
-        
-        for file in uploaded_files:
-            df_temp = read_data_file(file)
-            if df_temp is not None:
-                df_list.append(df_temp)
-                file_info.append({
-                    'name': file.name,
-                    'rows': len(df_temp),
-                    'format': file.name.split('.')[-1].upper()
-                })
-        
-        if not df_list:
+        # 读取所有上传的数据文件并合并（按文件内容缓存）
+        loaded = load_and_clean(
+            tuple((file.name, file.getvalue()) for file in uploaded_files),
+            data_type
+        )
+        
+        if loaded is None:
             st.error("没有成功读取任何文件，请检查文件格式")
             st.stop()
         
-        df = pd.concat(df_list, ignore_index=True)
+        # 换了数据后，带固定键的筛选控件不会自动回到默认值，需要先清除旧的选择
+        sync_filters_with_dataset((data_type, tuple(file.file_id for file in uploaded_files)))
+        
+        df = loaded['df']
+        file_info = loaded['file_info']
+        quality_report = loaded['quality_report']
         
         # 显示文件读取信息
         if len(file_info) > 1:
@@ -871,14 +1760,14 @@ if uploaded_files:
         if st.sidebar.checkbox("👀 数据预览", help="查看原始数据的前几行"):
             st.sidebar.subheader("📋 数据预览")
             preview_rows = st.sidebar.slider("预览行数", 1, 10, 3)
-            st.sidebar.dataframe(df.head(preview_rows), use_container_width=True)
-            st.sidebar.caption(f"数据形状: {df.shape[0]} 行 × {df.shape[1]} 列")
-        
-        # 智能列名标准化处理
-        df = standardize_column_names(df, data_type)
+            st.sidebar.dataframe(loaded['raw_preview'].head(preview_rows), use_container_width=True)
+            st.sidebar.caption(f"数据形状: {loaded['raw_shape'][0]} 行 × {loaded['raw_shape'][1]} 列")
         
-        # 数据质量检查和清洗
-        df, quality_report = clean_and_validate_data(df, data_type)
+        # 显示列名标准化信息
+        if loaded['column_mappings']:
+            with st.sidebar.expander("🔄 列名标准化"):
+                for old_name, new_name in loaded['column_mappings'].items():
+                    st.write(f"• {old_name} → {new_name}")
         
         # 显示数据质量报告
         if quality_report and st.sidebar.checkbox("📊 数据质量报告"):
@@ -901,9 +1790,8 @@ if uploaded_files:
                 st.metric("🏠 总面积", f"{total_area:,.0f}㎡")
         with col4:
             if data_type == '成交房源' and '成交日期' in df.columns:
-                # 解析成交日期并计算时间跨度
+                # 成交日期已在加载时解析，直接计算时间跨度
                 try:
-                    df['成交日期'] = pd.to_datetime(df['成交日期'])
                     date_range = (df['成交日期'].max() - df['成交日期'].min()).days
                     st.metric("📅 数据跨度", f"{date_range}天")
                 except:
@@ -917,194 +1805,166 @@ if uploaded_files:
         st.sidebar.header("🔍 数据筛选器")
         
         # 筛选器重置按钮
-        if st.sidebar.button("🔄 重置所有筛选器", help="重置所有筛选条件到默认状态"):
-            st.rerun()
+        st.sidebar.button("🔄 重置所有筛选器", help="重置所有筛选条件到默认状态", on_click=reset_filters)
         
         st.sidebar.markdown("---")
         
+        # 筛选器选项在加载时已算好
+        column_options = loaded['column_options']
+        district_circles = loaded['district_circles']
+        
         # === 地理位置筛选 ===
         st.sidebar.subheader("📍 地理位置")
         
         # 区域和商圈筛选
         if data_type == '在售房源' and '区域' in df.columns:
-            districts = sorted(df['区域'].unique())
+            districts = column_options['区域']
             selected_districts = st.sidebar.multiselect(
                 '🏙️ 选择区域', 
                 options=districts, 
                 default=districts,
-                help="选择要分析的行政区域"
+                help="选择要分析的行政区域",
+                key=FILTER_KEY_PREFIX + '区域',
+                on_change=reset_circle_filter
             )
             
             if '商圈' in df.columns:
-                available_circles = sorted(df[df['区域'].isin(selected_districts)]['商圈'].unique())
+                available_circles = sorted(set().union(*(district_circles.get(district, ()) for district in selected_districts)))
                 selected_circles = st.sidebar.multiselect(
                     '🏪 选择商圈', 
                     options=available_circles, 
                     default=available_circles,
-                    help="选择具体的商业圈"
+                    help="选择具体的商业圈",
+                    key=FILTER_KEY_PREFIX + '商圈'
                 )
         
         # === 价格和面积筛选 ===
         st.sidebar.subheader("💰 价格与面积")
         
         # 价格区间筛选
-        if '总价(万)' in df.columns and not df['总价(万)'].isna().all():
-            price_data = df['总价(万)'].dropna()
-            if len(price_data) > 0:
-                price_range = st.sidebar.slider(
-                    '💰 总价区间 (万元)',
-                    min_value=int(price_data.min()),
-                    max_value=int(price_data.max()),
-                    value=(int(price_data.min()), int(price_data.max())),
-                    help="设置房源总价筛选范围"
-                )
-                min_price, max_price = price_range
+        column_bounds = loaded['column_bounds']
+        if '总价(万)' in column_bounds:
+            price_bounds = column_bounds['总价(万)']
+            price_range = st.sidebar.slider(
+                '💰 总价区间 (万元)',
+                min_value=price_bounds[0],
+                max_value=price_bounds[1],
+                value=price_bounds,
+                help="设置房源总价筛选范围",
+                key=FILTER_KEY_PREFIX + '总价'
+            )
+            min_price, max_price = price_range
         
         # 面积筛选
-        if '面积(㎡)' in df.columns and not df['面积(㎡)'].isna().all():
-            area_data = df['面积(㎡)'].dropna()
-            if len(area_data) > 0:
-                area_range = st.sidebar.slider(
-                    '🏠 面积区间 (㎡)',
-                    min_value=int(area_data.min()),
-                    max_value=int(area_data.max()),
-                    value=(int(area_data.min()), int(area_data.max())),
-                    help="设置房源面积筛选范围"
-                )
-                min_area, max_area = area_range
+        if '面积(㎡)' in column_bounds:
+            area_bounds = column_bounds['面积(㎡)']
+            area_range = st.sidebar.slider(
+                '🏠 面积区间 (㎡)',
+                min_value=area_bounds[0],
+                max_value=area_bounds[1],
+                value=area_bounds,
+                help="设置房源面积筛选范围",
+                key=FILTER_KEY_PREFIX + '面积'
+            )
+            min_area, max_area = area_range
         
         # === 房屋属性筛选 ===
         st.sidebar.subheader("🏠 房屋属性")
         
         # 房龄筛选
         year_col = '建成年代' if '建成年代' in df.columns else '年代'
-        if year_col in df.columns and not df[year_col].isna().all():
-            year_data = df[year_col].dropna()
-            if len(year_data) > 0:
-                current_year = datetime.now().year
-                min_year, max_year = int(year_data.min()), int(year_data.max())
-                selected_years = st.sidebar.slider(
-                    '🏗️ 建成年代',
-                    min_value=min_year,
-                    max_value=max_year,
-                    value=(min_year, max_year),
-                    help="选择房屋建成年代范围"
-                )
-                
-                # 显示对应房龄
-                min_age = current_year - selected_years[1]
-                max_age = current_year - selected_years[0]
-                st.sidebar.caption(f"对应房龄：{min_age}-{max_age}年")
+        if year_col in column_bounds:
+            current_year = datetime.now().year
+            min_year, max_year = column_bounds[year_col]
+            selected_years = st.sidebar.slider(
+                '🏗️ 建成年代',
+                min_value=min_year,
+                max_value=max_year,
+                value=(min_year, max_year),
+                help="选择房屋建成年代范围",
+                key=FILTER_KEY_PREFIX + '年代'
+            )
+            
+            # 显示对应房龄
+            min_age = current_year - selected_years[1]
+            max_age = current_year - selected_years[0]
+            st.sidebar.caption(f"对应房龄：{min_age}-{max_age}年")
 
         # 户型分类筛选
         if '户型' in df.columns:
-            # 提取户型主要类别
-            def extract_room_type(huxing):
-                if pd.isna(huxing):
-                    return '未知'
-                huxing_str = str(huxing)
-                if '1室' in huxing_str:
-                    return '1室'
-                elif '2室' in huxing_str:
-                    return '2室'
-                elif '3室' in huxing_str:
-                    return '3室'
-                elif '4室' in huxing_str:
-                    return '4室'
-                elif '5室' in huxing_str:
-                    return '5室+'
-                else:
-                    return '其他'
-            
-            df['户型分类'] = df['户型'].apply(extract_room_type)
-            room_types = sorted(df['户型分类'].unique())
+            room_types = column_options['户型分类']
             
             selected_room_types = st.sidebar.multiselect(
                 '🏠 选择户型',
                 options=room_types,
                 default=room_types,
-                help="选择要分析的户型类别"
+                help="选择要分析的户型类别",
+                key=FILTER_KEY_PREFIX + '户型'
             )
 
         # 楼层分类筛选
         floor_col = '楼层信息' if '楼层信息' in df.columns else '楼层'
         if floor_col in df.columns:
-            # 提取楼层分类
-            def extract_floor_type(floor_info):
-                if pd.isna(floor_info):
-                    return '未知'
-                floor_str = str(floor_info)
-                if '低楼层' in floor_str or '底层' in floor_str:
-                    return '低楼层'
-                elif '中楼层' in floor_str or '中层' in floor_str:
-                    return '中楼层'
-                elif '高楼层' in floor_str or '顶层' in floor_str:
-                    return '高楼层'
-                else:
-                    return '其他'
-            
-            df['楼层分类'] = df[floor_col].apply(extract_floor_type)
-            floor_types = sorted(df['楼层分类'].unique())
+            floor_types = column_options['楼层分类']
             
             selected_floor_types = st.sidebar.multiselect(
                 '🏢 选择楼层',
                 options=floor_types,
                 default=floor_types,
-                help="选择要分析的楼层类别"
+                help="选择要分析的楼层类别",
+                key=FILTER_KEY_PREFIX + '楼层'
             )
 
         # 装修状况筛选
         if '装修' in df.columns:
-            decoration_types = sorted(df['装修'].dropna().unique())
+            decoration_types = column_options['装修']
             if len(decoration_types) > 0:
                 selected_decorations = st.sidebar.multiselect(
                     '🎨 选择装修状况',
                     options=decoration_types,
                     default=decoration_types,
-                    help="选择要分析的装修状况"
+                    help="选择要分析的装修状况",
+                    key=FILTER_KEY_PREFIX + '装修'
                 )
 
         # 应用筛选条件
-        filtered_df = df.copy()
+        filters = []
         
         # 区域和商圈筛选
         if data_type == '在售房源' and '区域' in df.columns:
-            filtered_df = filtered_df[filtered_df['区域'].isin(selected_districts)]
+            add_selection_filter(filters, '区域', selected_districts, districts)
             if '商圈' in df.columns and 'selected_circles' in locals():
-                filtered_df = filtered_df[filtered_df['商圈'].isin(selected_circles)]
+                add_selection_filter(filters, '商圈', selected_circles, available_circles)
         
         # 价格筛选
         if '总价(万)' in df.columns and 'min_price' in locals():
-            filtered_df = filtered_df[
-                (filtered_df['总价(万)'] >= min_price) &
-                (filtered_df['总价(万)'] <= max_price)
-            ]
+            filters.append(('总价(万)', (min_price, max_price)))
         
         # 面积筛选
         if '面积(㎡)' in df.columns and 'min_area' in locals():
-            filtered_df = filtered_df[
-                (filtered_df['面积(㎡)'] >= min_area) &
-                (filtered_df['面积(㎡)'] <= max_area)
-            ]
+            filters.append(('面积(㎡)', (min_area, max_area)))
         
         # 房龄筛选
         if year_col in df.columns and 'selected_years' in locals():
-            filtered_df = filtered_df[
-                (filtered_df[year_col] >= selected_years[0]) &
-                (filtered_df[year_col] <= selected_years[1])
-            ]
+            filters.append((year_col, tuple(selected_years)))
         
         # 户型筛选
         if '户型' in df.columns and 'selected_room_types' in locals():
-            filtered_df = filtered_df[filtered_df['户型分类'].isin(selected_room_types)]
+            add_selection_filter(filters, '户型分类', selected_room_types, room_types)
         
         # 楼层筛选
         if floor_col in df.columns and 'selected_floor_types' in locals():
-            filtered_df = filtered_df[filtered_df['楼层分类'].isin(selected_floor_types)]
+            add_selection_filter(filters, '楼层分类', selected_floor_types, floor_types)
         
         # 装修状况筛选
         if '装修' in df.columns and 'selected_decorations' in locals():
-            filtered_df = filtered_df[filtered_df['装修'].isin(selected_decorations)]
+            # 装修选项不含空值，有空值时全选也需要筛选
+            if loaded['decoration_has_nans']:
+                filters.append(('装修', selected_decorations))
+            else:
+                add_selection_filter(filters, '装修', selected_decorations, decoration_types)
+        
+        filtered_df = apply_filters(df, tuple(filters))
         
         # 筛选结果提示
         filter_ratio = len(filtered_df) / len(df) * 100
@@ -1121,19 +1981,19 @@ if uploaded_files:
         # 筛选条件摘要
         active_filters = []
         if data_type == '在售房源' and '区域' in df.columns and 'selected_districts' in locals():
-            if len(selected_districts) < len(df['区域'].unique()):
+            if len(selected_districts) < len(districts):
                 active_filters.append(f"区域: {len(selected_districts)}个")
         
         if '户型' in df.columns and 'selected_room_types' in locals():
-            if len(selected_room_types) < len(df['户型分类'].unique()):
+            if len(selected_room_types) < len(room_types):
                 active_filters.append(f"户型: {len(selected_room_types)}类")
         
         if floor_col in df.columns and 'selected_floor_types' in locals():
-            if len(selected_floor_types) < len(df['楼层分类'].unique()):
+            if len(selected_floor_types) < len(floor_types):
                 active_filters.append(f"楼层: {len(selected_floor_types)}类")
         
         if '装修' in df.columns and 'selected_decorations' in locals():
-            if len(selected_decorations) < len(df['装修'].dropna().unique()):
+            if len(selected_decorations) < len(decoration_types):
                 active_filters.append(f"装修: {len(selected_decorations)}类")
         
         if active_filters:
@@ -1151,14 +2011,15 @@ if uploaded_files:
         # 计算市场细分数据
         segments = analyze_market_segments(filtered_df, '总价(万)', '面积(㎡)')
         price_stats = calculate_price_per_sqm_stats(filtered_df, '单价(元/平)', '面积(㎡)')
+        overview_stats = calculate_overview_stats(filtered_df)
         
         # 核心指标展示
         col1, col2, col3, col4, col5 = st.columns(5)
         
         with col1:
             if '总价(万)' in filtered_df.columns:
-                avg_price = filtered_df['总价(万)'].mean()
-                median_price = filtered_df['总价(万)'].median()
+                avg_price = overview_stats.at['mean', '总价(万)']
+                median_price = overview_stats.at['median', '总价(万)']
                 st.metric(
                     "💰 平均总价", 
                     f"{avg_price:.1f}万",
@@ -1175,8 +2036,8 @@ if uploaded_files:
         
         with col3:
             if '面积(㎡)' in filtered_df.columns:
-                avg_area = filtered_df['面积(㎡)'].mean()
-                median_area = filtered_df['面积(㎡)'].median()
+                avg_area = overview_stats.at['mean', '面积(㎡)']
+                median_area = overview_stats.at['median', '面积(㎡)']
                 st.metric(
                     "🏠 平均面积", 
                     f"{avg_area:.1f}㎡",
@@ -1185,20 +2046,20 @@ if uploaded_files:
         
         with col4:
             if data_type == '成交房源' and '成交周期(天)' in filtered_df.columns:
-                avg_cycle = filtered_df['成交周期(天)'].mean()
-                median_cycle = filtered_df['成交周期(天)'].median()
+                avg_cycle = overview_stats.at['mean', '成交周期(天)']
+                median_cycle = overview_stats.at['median', '成交周期(天)']
                 st.metric(
                     "⏱️ 平均成交周期", 
                     f"{avg_cycle:.0f}天",
                     delta=f"中位数: {median_cycle:.0f}天"
                 )
             elif '关注人数' in filtered_df.columns:
-                avg_attention = filtered_df['关注人数'].mean()
+                avg_attention = overview_stats.at['mean', '关注人数']
                 st.metric("👥 平均关注度", f"{avg_attention:.0f}人")
         
         with col5:
             if price_stats:
-                price_cv = price_stats['std'] / price_stats['mean'] * 100
+                price_cv = price_stats['cv'] * 100
                 st.metric(
                     "📊 价格离散度", 
                     f"{price_cv:.1f}%",
@@ -1218,33 +2079,11 @@ if uploaded_files:
             if '单价(元/平)' in filtered_df.columns:
                 st.subheader("💹 单价分布分析")
                 
-                fig_box = go.Figure()
+                # 只取绘图用到的列再去空值，px.box 按区域一次分组生成各箱线
+                box_cols = [col for col in ['区域', '单价(元/平)'] if col in filtered_df.columns]
+                box_data = filtered_df[box_cols].dropna(subset=['单价(元/平)'])
                 
-                if data_type == '在售房源' and '区域' in filtered_df.columns:
-                    for district in filtered_df['区域'].unique():
-                        district_data = filtered_df[filtered_df['区域'] == district]['单价(元/平)'].dropna()
-                        if len(district_data) > 0:
-                            fig_box.add_trace(go.Box(
-                                y=district_data,
-                                name=district,
-                                boxpoints='outliers'
-                            ))
-                    fig_box.update_layout(
-                        title="各区域单价分布对比",
-                        yaxis_title="单价 (元/㎡)",
-                        showlegend=True
-                    )
-                else:
-                    price_data = filtered_df['单价(元/平)'].dropna()
-                    fig_box.add_trace(go.Box(
-                        y=price_data,
-                        name="整体分布",
-                        boxpoints='outliers'
-                    ))
-                    fig_box.update_layout(
-                        title="单价整体分布",
-                        yaxis_title="单价 (元/㎡)"
-                    )
+                fig_box = price_box_figure(box_data, by_region=data_type == '在售房源' and '区域' in filtered_df.columns)
                 
                 st.plotly_chart(fig_box, use_container_width=True)
         
@@ -1255,29 +2094,41 @@ if uploaded_files:
                 
                 scatter_data = filtered_df.dropna(subset=['面积(㎡)', '总价(万)', '单价(元/平)'])
                 if len(scatter_data) > 0:
-                    fig_scatter = px.scatter(
-                        scatter_data,
-                        x='面积(㎡)',
-                        y='总价(万)',
-                        size='单价(元/平)',
-                        color='区域' if '区域' in scatter_data.columns else None,
-                        hover_data=['小区名称', '户型'] if '小区名称' in scatter_data.columns else None,
-                        title="面积-总价-单价三维关系",
-                        labels={'size': '单价(元/㎡)'}
-                    )
+                    # 数据点过多时按区域分层抽样，减少传给浏览器的数据量
+                    max_points = 5000
+                    if len(scatter_data) > max_points:
+                        sample_frac = max_points / len(scatter_data)
+                        if '区域' in scatter_data.columns:
+                            # 按分类编码分组，区域为空（编码 -1）的房源自成一组，不会被抽样丢掉；
+                            # 各区域按比例取整后总数可能略超上限，超出部分再随机去掉
+                            region_codes = scatter_data['区域'].cat.codes
+                            plot_data = scatter_data.groupby(region_codes).sample(frac=sample_frac, random_state=0)
+                            if len(plot_data) > max_points:
+                                plot_data = plot_data.sample(n=max_points, random_state=0)
+                        else:
+                            plot_data = scatter_data.sample(n=max_points, random_state=0)
+                    else:
+                        plot_data = scatter_data
                     
-                    # 添加简单的线性趋势线（不依赖statsmodels）
+                    fig_scatter = area_price_scatter_figure(plot_data)
+                    
+                    # 添加简单的线性趋势线（不依赖statsmodels），基于全部数据拟合
                     try:
-                        x_vals = scatter_data['面积(㎡)'].values
-                        y_vals = scatter_data['总价(万)'].values
+                        x_vals = scatter_data['面积(㎡)'].to_numpy(np.float64)
+                        y_vals = scatter_data['总价(万)'].to_numpy(np.float64)
                         
-                        # 使用numpy进行简单线性回归
-                        z = np.polyfit(x_vals, y_vals, 1)
-                        p = np.poly1d(z)
+                        # 一元线性回归的闭式解：斜率 = 协方差 / 方差，用中心化后的值避免大数相减损失精度
+                        x_mean = x_vals.mean()
+                        y_mean = y_vals.mean()
+                        x_dev = x_vals - x_mean
+                        slope = np.dot(x_dev, y_vals - y_mean) / np.dot(x_dev, x_dev)
+                        intercept = y_mean - slope * x_mean
                         
+                        # 直线只需两个端点
+                        x_line = np.array([x_vals.min(), x_vals.max()])
                         fig_scatter.add_trace(go.Scatter(
-                            x=x_vals,
-                            y=p(x_vals),
+                            x=x_line,
+                            y=slope * x_line + intercept,
                             mode='lines',
                             name='趋势线',
                             line=dict(color='red', dash='dash')
@@ -1285,6 +2136,9 @@ if uploaded_files:
                     except:
                         pass  # 如果趋势线添加失败，继续显示散点图
                     
+                    if len(plot_data) < len(scatter_data):
+                        st.caption(f"数据点较多，图中抽样展示 {len(plot_data):,} / {len(scatter_data):,} 个点，趋势线基于全部数据")
+                    
                     st.plotly_chart(fig_scatter, use_container_width=True)
 
         # 第二行图表
@@ -1297,11 +2151,7 @@ if uploaded_files:
                 
                 area_seg_data = segments['area_segments'].reset_index()
                 
-                fig_seg = make_subplots(
-                    rows=1, cols=2,
-                    subplot_titles=('房源数量分布', '平均总价对比'),
-                    specs=[[{"secondary_y": False}, {"secondary_y": False}]]
-                )
+                fig_seg = go.Figure(segment_chart_layout())
                 
                 # 数量分布
                 fig_seg.add_trace(
@@ -1317,9 +2167,6 @@ if uploaded_files:
                     row=1, col=2
                 )
                 
-                fig_seg.update_layout(height=400, showlegend=False)
-                fig_seg.update_xaxes(tickangle=45)
-                
                 st.plotly_chart(fig_seg, use_container_width=True)
         
         with col2:
@@ -1328,19 +2175,8 @@ if uploaded_files:
             if year_col in filtered_df.columns:
                 st.subheader("🏗️ 房龄与价格关系")
                 
-                year_data = filtered_df.dropna(subset=[year_col, '单价(元/平)'])
-                if len(year_data) > 0:
-                    current_year = datetime.now().year
-                    year_data['房龄'] = current_year - year_data[year_col]
-                    
-                    # 按房龄分组
-                    age_groups = pd.cut(year_data['房龄'], 
-                                      bins=[0, 5, 10, 20, 30, float('inf')], 
-                                      labels=['新房(≤5年)', '次新房(6-10年)', '中等房龄(11-20年)', '老房(21-30年)', '超老房(>30年)'])
-                    year_data['房龄段'] = age_groups
-                    
-                    age_price = year_data.groupby('房龄段', observed=True)['单价(元/平)'].agg(['mean', 'count']).reset_index()
-                    
+                age_price = analyze_age_price(filtered_df, year_col)
+                if age_price is not None:
                     fig_age = go.Figure()
                     fig_age.add_trace(go.Bar(
                         x=age_price['房龄段'],
@@ -1366,46 +2202,30 @@ if uploaded_files:
             # 时间序列数据处理
             if '成交日期' in filtered_df.columns:
                 try:
-                    # 确保成交日期是datetime格式
-                    filtered_df['成交日期'] = pd.to_datetime(filtered_df['成交日期'], errors='coerce')
-                    time_data = filtered_df.dropna(subset=['成交日期'])
+                    # 解析成交日期并添加时间维度列（按筛选结果缓存）
+                    time_data = add_time_columns(filtered_df)
                     
                     if len(time_data) > 0:
-                        # 添加时间维度列
-                        time_data['年月'] = time_data['成交日期'].dt.to_period('M')
-                        time_data['季度'] = time_data['成交日期'].dt.to_period('Q')
-                        time_data['年份'] = time_data['成交日期'].dt.year
-                        time_data['月份'] = time_data['成交日期'].dt.month
-                        
                         # === 核心量价趋势分析 ===
                         st.subheader("📈 量价趋势核心分析")
                         
-                        # 按月统计成交量和均价
-                        monthly_stats = time_data.groupby('年月').agg({
-                            '总价(万)': ['count', 'mean', 'median'],
-                            '单价(元/平)': ['mean', 'median'],
-                            '面积(㎡)': 'mean',
-                            '成交周期(天)': 'mean'
-                        }).round(2)
+                        # 按月统计成交量和均价（按时间数据缓存）
+                        monthly_raw = calculate_monthly_stats(time_data)
                         
-                        # 重命名列
-                        monthly_stats.columns = ['成交量', '平均总价', '中位总价', '平均单价', '中位单价', '平均面积', '平均成交周期']
+                        monthly_stats = monthly_raw[['成交量', '平均总价', '中位总价', '平均单价', '中位单价', '平均面积', '平均成交周期']].round(2)
                         monthly_stats = monthly_stats.reset_index()
-                        monthly_stats['年月日期'] = monthly_stats['年月'].dt.to_timestamp()
+                        monthly_stats['年月日期'] = pd.to_datetime(monthly_stats['年月'].astype(str), format='%Y%m')
                         
-                        # 创建量价双轴图表
-                        fig_volume_price = make_subplots(
-                            rows=2, cols=1,
-                            subplot_titles=('📊 月度成交量趋势', '💰 月度价格趋势'),
-                            vertical_spacing=0.1,
-                            specs=[[{"secondary_y": True}], [{"secondary_y": True}]]
-                        )
+                        # 创建量价双轴图表，各曲线共用同一组 NumPy 数组，不再逐条从 DataFrame 取列
+                        fig_volume_price = go.Figure(volume_price_chart_layout())
+                        month_dates = monthly_stats['年月日期'].to_numpy()
+                        month_volumes = monthly_stats['成交量'].to_numpy()
                         
                         # 第一行：成交量趋势
                         fig_volume_price.add_trace(
                             go.Bar(
-                                x=monthly_stats['年月日期'],
-                                y=monthly_stats['成交量'],
+                                x=month_dates,
+                                y=month_volumes,
                                 name='月成交量',
                                 marker_color='lightblue',
                                 yaxis='y1'
@@ -1416,8 +2236,8 @@ if uploaded_files:
                         # 添加成交量趋势线
                         fig_volume_price.add_trace(
                             go.Scatter(
-                                x=monthly_stats['年月日期'],
-                                y=monthly_stats['成交量'],
+                                x=month_dates,
+                                y=month_volumes,
                                 mode='lines+markers',
                                 name='成交量趋势',
                                 line=dict(color='blue', width=3),
@@ -1429,8 +2249,8 @@ if uploaded_files:
                         # 第二行：价格趋势
                         fig_volume_price.add_trace(
                             go.Scatter(
-                                x=monthly_stats['年月日期'],
-                                y=monthly_stats['平均单价'],
+                                x=month_dates,
+                                y=monthly_stats['平均单价'].to_numpy(),
                                 mode='lines+markers',
                                 name='平均单价',
                                 line=dict(color='red', width=3),
@@ -1441,8 +2261,8 @@ if uploaded_files:
                         
                         fig_volume_price.add_trace(
                             go.Scatter(
-                                x=monthly_stats['年月日期'],
-                                y=monthly_stats['中位单价'],
+                                x=month_dates,
+                                y=monthly_stats['中位单价'].to_numpy(),
                                 mode='lines+markers',
                                 name='中位单价',
                                 line=dict(color='orange', width=2, dash='dash'),
@@ -1451,18 +2271,6 @@ if uploaded_files:
                             row=2, col=1
                         )
                         
-                        # 更新布局
-                        fig_volume_price.update_layout(
-                            height=600,
-                            title_text="🏠 房产市场量价趋势分析",
-                            showlegend=True
-                        )
-                        
-                        # 更新Y轴标签
-                        fig_volume_price.update_yaxes(title_text="成交套数", row=1, col=1)
-                        fig_volume_price.update_yaxes(title_text="单价 (元/㎡)", row=2, col=1)
-                        fig_volume_price.update_xaxes(title_text="时间", row=2, col=1)
-                        
                         st.plotly_chart(fig_volume_price, use_container_width=True)
                         
                         # === 市场热度分析 ===
@@ -1504,21 +2312,14 @@ if uploaded_files:
                         with col2:
                             st.subheader("📊 季度对比分析")
                             
-                            # 季度统计
-                            quarterly_stats = time_data.groupby('季度').agg({
-                                '总价(万)': ['count', 'mean'],
-                                '单价(元/平)': 'mean',
-                                '成交周期(天)': 'mean'
-                            }).round(2)
-                            
-                            quarterly_stats.columns = ['成交量', '平均总价', '平均单价', '平均成交周期']
-                            quarterly_stats = quarterly_stats.reset_index()
+                            # 季度统计：由月度求和与计数再聚合
+                            quarterly_stats = calculate_quarterly_stats(monthly_raw)
                             
                             if len(quarterly_stats) > 0:
                                 fig_quarterly = go.Figure()
                                 
                                 fig_quarterly.add_trace(go.Bar(
-                                    x=[str(q) for q in quarterly_stats['季度']],
+                                    x=[f"{q // 10}Q{q % 10}" for q in quarterly_stats['季度']],
                                     y=quarterly_stats['成交量'],
                                     name='季度成交量',
                                     text=quarterly_stats['成交量'],
@@ -1540,25 +2341,20 @@ if uploaded_files:
                         
                         # 计算环比变化
                         monthly_display = monthly_stats.copy()
-                        monthly_display['成交量环比'] = monthly_display['成交量'].pct_change() * 100
-                        monthly_display['单价环比'] = monthly_display['平均单价'].pct_change() * 100
+                        monthly_display['成交量环比'] = calculate_change_rate(monthly_display['成交量'])
+                        monthly_display['单价环比'] = calculate_change_rate(monthly_display['平均单价'])
                         
                         # 格式化显示
-                        monthly_display['年月'] = monthly_display['年月'].astype(str)
+                        monthly_display['年月'] = monthly_display['年月日期'].dt.strftime('%Y-%m')
                         monthly_display = monthly_display[['年月', '成交量', '成交量环比', '平均单价', '单价环比', '平均成交周期']].round(2)
                         
                         # 添加颜色标识
-                        def highlight_changes(val):
-                            if pd.isna(val):
-                                return ''
-                            elif val > 0:
-                                return 'color: red'
-                            elif val < 0:
-                                return 'color: green'
-                            else:
-                                return ''
+                        def highlight_changes(column):
+                            # 按整列生成样式，上涨标红、下跌标绿，空值和持平不着色
+                            values = column.to_numpy(dtype=np.float64)
+                            return np.where(values > 0, 'color: red', np.where(values < 0, 'color: green', ''))
                         
-                        styled_df = monthly_display.style.applymap(highlight_changes, subset=['成交量环比', '单价环比'])
+                        styled_df = monthly_display.style.apply(highlight_changes, subset=['成交量环比', '单价环比'])
                         st.dataframe(styled_df, use_container_width=True)
                         
                 except Exception as e:
@@ -1573,18 +2369,16 @@ if uploaded_files:
                 if '成交周期(天)' in filtered_df.columns:
                     st.subheader("⏰ 成交周期分布")
                     
-                    cycle_data = filtered_df['成交周期(天)'].dropna()
-                    if len(cycle_data) > 0:
-                        # 成交周期分段
-                        cycle_bins = [0, 30, 60, 90, 180, float('inf')]
-                        cycle_labels = ['快速成交(≤30天)', '正常成交(31-60天)', '缓慢成交(61-90天)', '困难成交(91-180天)', '超长周期(>180天)']
-                        cycle_groups = pd.cut(cycle_data, bins=cycle_bins, labels=cycle_labels)
-                        
-                        cycle_dist = cycle_groups.value_counts().reset_index()
-                        cycle_dist.columns = ['成交周期段', '数量']
-                        
-                        fig_cycle = px.pie(cycle_dist, names='成交周期段', values='数量', 
-                                         title="成交周期分布")
+                    # 成交周期分段统计（按筛选结果缓存）
+                    cycle_dist = calculate_cycle_distribution(filtered_df['成交周期(天)'])
+                    if cycle_dist is not None:
+                        # 只有五个分段，直接构造饼图，不经过 plotly express 的列推断
+                        fig_cycle = go.Figure(go.Pie(
+                            labels=cycle_dist['成交周期段'].tolist(),
+                            values=cycle_dist['数量'].tolist(),
+                            hovertemplate='成交周期段=%{label}<br>数量=%{value}<extra></extra>'
+                        ))
+                        fig_cycle.update_layout(title="成交周期分布", legend_tracegroupgap=0)
                         st.plotly_chart(fig_cycle, use_container_width=True)
             
             with col2:
@@ -1592,20 +2386,27 @@ if uploaded_files:
                 if '挂牌价(万)' in filtered_df.columns and '总价(万)' in filtered_df.columns:
                     st.subheader("💸 成交折价率分析")
                     
-                    price_data = filtered_df.dropna(subset=['挂牌价(万)', '总价(万)'])
-                    if len(price_data) > 0:
-                        price_data['折价率'] = (price_data['挂牌价(万)'] - price_data['总价(万)']) / price_data['挂牌价(万)'] * 100
-                        
-                        fig_discount = px.histogram(
-                            price_data, 
-                            x='折价率', 
-                            nbins=20,
+                    discount_rates = calculate_discount_rates(filtered_df[['挂牌价(万)', '总价(万)']])
+                    if len(discount_rates) > 0:
+                        # 在服务端分箱，只把20个分箱计数传给浏览器
+                        finite_rates = discount_rates[np.isfinite(discount_rates)]
+                        counts, edges = np.histogram(finite_rates, bins=20)
+                        fig_discount = go.Figure(go.Bar(
+                            x=(edges[:-1] + edges[1:]) / 2,
+                            y=counts,
+                            width=np.diff(edges),
+                            name='房源数量',
+                            hovertemplate='折价率 (%)=%{x:.1f}<br>房源数量=%{y}<extra></extra>'
+                        ))
+                        fig_discount.update_layout(
                             title="成交折价率分布",
-                            labels={'折价率': '折价率 (%)', 'count': '房源数量'}
+                            xaxis_title="折价率 (%)",
+                            yaxis_title="房源数量",
+                            bargap=0
                         )
                         
                         # 添加平均折价率线
-                        avg_discount = price_data['折价率'].mean()
+                        avg_discount = discount_rates.mean()
                         fig_discount.add_vline(x=avg_discount, line_dash="dash", 
                                              annotation_text=f"平均折价率: {avg_discount:.1f}%")
                         
@@ -1616,326 +2417,52 @@ if uploaded_files:
             st.markdown("---")
             st.header("🏆 小区排行榜")
             
-            # 排行榜控制选项
-            ranking_col1, ranking_col2, ranking_col3 = st.columns(3)
-            
-            with ranking_col1:
-                ranking_metric = st.selectbox(
-                    "排序维度",
-                    ["成交量", "成交均价", "成交总价", "成交周期"],
-                    help="选择小区排行的评判标准"
-                )
-            
-            with ranking_col2:
-                top_n = st.selectbox(
-                    "显示数量",
-                    [10, 20, 30, 50],
-                    help="选择显示排行榜前N名"
-                )
-            
-            with ranking_col3:
-                sort_order = st.selectbox(
-                    "排序方式",
-                    ["从高到低", "从低到高"],
-                    help="选择排序顺序"
-                )
-            
-            # 计算小区统计数据
-            try:
-                community_stats = filtered_df.groupby('小区名称').agg({
-                    '总价(万)': ['count', 'mean', 'sum'],
-                    '单价(元/平)': 'mean' if '单价(元/平)' in filtered_df.columns else lambda x: None,
-                    '面积(㎡)': 'mean',
-                    '成交周期(天)': 'mean' if '成交周期(天)' in filtered_df.columns else lambda x: None
-                }).round(2)
-                
-                # 重命名列
-                if '成交周期(天)' in filtered_df.columns and '单价(元/平)' in filtered_df.columns:
-                    community_stats.columns = ['成交套数', '平均总价', '总成交额', '平均单价', '平均面积', '平均成交周期']
-                elif '单价(元/平)' in filtered_df.columns:
-                    community_stats.columns = ['成交套数', '平均总价', '总成交额', '平均单价', '平均面积']
-                    community_stats['平均成交周期'] = None
-                elif '成交周期(天)' in filtered_df.columns:
-                    community_stats.columns = ['成交套数', '平均总价', '总成交额', '平均面积', '平均成交周期']
-                    community_stats['平均单价'] = None
-                else:
-                    community_stats.columns = ['成交套数', '平均总价', '总成交额', '平均面积']
-                    community_stats['平均单价'] = None
-                    community_stats['平均成交周期'] = None
-                
-                community_stats = community_stats.reset_index()
-                
-                # 过滤掉成交套数少于3套的小区（避免数据不具代表性）
-                community_stats = community_stats[community_stats['成交套数'] >= 3]
-                
-                if len(community_stats) > 0:
-                    # 根据选择的维度排序
-                    if ranking_metric == "成交量":
-                        sort_col = '成交套数'
-                        metric_unit = '套'
-                        metric_desc = '成交套数越多，说明小区越受欢迎'
-                    elif ranking_metric == "成交均价":
-                        if '平均单价' in community_stats.columns and community_stats['平均单价'].notna().any():
-                            sort_col = '平均单价'
-                            metric_unit = '元/㎡'
-                            metric_desc = '单价越高，说明小区品质和地段越好'
-                        else:
-                            st.warning("当前数据中没有单价信息，改为按成交量排序")
-                            sort_col = '成交套数'
-                            metric_unit = '套'
-                            metric_desc = '成交套数越多，说明小区越受欢迎'
-                    elif ranking_metric == "成交总价":
-                        sort_col = '平均总价'
-                        metric_unit = '万元'
-                        metric_desc = '总价越高，说明小区房源价值越高'
-                    elif ranking_metric == "成交周期":
-                        if '平均成交周期' in community_stats.columns and community_stats['平均成交周期'].notna().any():
-                            sort_col = '平均成交周期'
-                            metric_unit = '天'
-                            metric_desc = '成交周期越短，说明小区房源越好卖'
-                        else:
-                            st.warning("当前数据中没有成交周期信息，改为按成交量排序")
-                            sort_col = '成交套数'
-                            metric_unit = '套'
-                            metric_desc = '成交套数越多，说明小区越受欢迎'
-                    
-                    # 处理成交周期为空的情况
-                    if sort_col == '平均成交周期' and community_stats['平均成交周期'].isna().all():
-                        st.warning("成交周期数据不完整，改为按成交量排序")
-                        sort_col = '成交套数'
-                        metric_unit = '套'
-                        metric_desc = '成交套数越多，说明小区越受欢迎'
-                    
-                    # 排序
-                    ascending = (sort_order == "从低到高")
-                    if sort_col == '平均成交周期':
-                        # 成交周期排序时，先过滤掉空值
-                        valid_cycle_data = community_stats.dropna(subset=[sort_col])
-                        if len(valid_cycle_data) > 0:
-                            community_ranking = valid_cycle_data.sort_values(sort_col, ascending=ascending).head(top_n)
-                        else:
-                            st.warning("没有有效的成交周期数据")
-                            community_ranking = community_stats.sort_values('成交套数', ascending=False).head(top_n)
-                    else:
-                        community_ranking = community_stats.sort_values(sort_col, ascending=ascending).head(top_n)
-                    
-                    # 显示排行榜
-                    st.subheader(f"🏆 {ranking_metric}排行榜 TOP {top_n}")
-                    st.caption(f"💡 {metric_desc}")
-                    
-                    # 创建排行榜可视化
-                    fig_ranking = go.Figure()
-                    
-                    # 添加柱状图
-                    fig_ranking.add_trace(go.Bar(
-                        y=community_ranking['小区名称'][::-1],  # 反转顺序，让第一名在顶部
-                        x=community_ranking[sort_col][::-1],
-                        orientation='h',
-                        text=[f"{val:.0f}{metric_unit}" if not pd.isna(val) else "N/A" 
-                              for val in community_ranking[sort_col][::-1]],
-                        textposition='auto',
-                        marker=dict(
-                            color=community_ranking[sort_col][::-1],
-                            colorscale='Viridis',
-                            showscale=True,
-                            colorbar=dict(title=f"{ranking_metric}({metric_unit})")
-                        )
-                    ))
-                    
-                    fig_ranking.update_layout(
-                        title=f"{ranking_metric}排行榜",
-                        xaxis_title=f"{ranking_metric} ({metric_unit})",
-                        yaxis_title="小区名称",
-                        height=max(400, len(community_ranking) * 25),
-                        showlegend=False
-                    )
-                    
-                    st.plotly_chart(fig_ranking, use_container_width=True)
-                    
-                    # 显示详细排行榜表格
-                    st.subheader("📋 详细排行榜数据")
-                    
-                    # 添加排名列
-                    ranking_display = community_ranking.copy()
-                    ranking_display.insert(0, '排名', range(1, len(ranking_display) + 1))
-                    
-                    # 格式化数值显示
-                    if '平均单价' in ranking_display.columns:
-                        ranking_display['平均单价'] = ranking_display['平均单价'].apply(lambda x: f"{x:,.0f}" if not pd.isna(x) else "N/A")
-                    ranking_display['平均总价'] = ranking_display['平均总价'].apply(lambda x: f"{x:.1f}" if not pd.isna(x) else "N/A")
-                    ranking_display['总成交额'] = ranking_display['总成交额'].apply(lambda x: f"{x:.1f}" if not pd.isna(x) else "N/A")
-                    ranking_display['平均面积'] = ranking_display['平均面积'].apply(lambda x: f"{x:.1f}" if not pd.isna(x) else "N/A")
-                    if '平均成交周期' in ranking_display.columns:
-                        ranking_display['平均成交周期'] = ranking_display['平均成交周期'].apply(lambda x: f"{x:.0f}" if not pd.isna(x) else "N/A")
-                    
-                    # 重命名列以便显示
-                    display_columns = {
-                        '排名': '排名',
-                        '小区名称': '小区名称',
-                        '成交套数': '成交套数',
-                        '平均单价': '平均单价(元/㎡)',
-                        '平均总价': '平均总价(万)',
-                        '总成交额': '总成交额(万)',
-                        '平均面积': '平均面积(㎡)'
-                    }
-                    
-                    if '平均成交周期' in ranking_display.columns:
-                        display_columns['平均成交周期'] = '平均成交周期(天)'
-                    
-                    ranking_display = ranking_display.rename(columns=display_columns)
-                    
-                    # 高亮显示前三名
-                    def highlight_top3(row):
-                        if row['排名'] == 1:
-                            return ['background-color: #FFD700'] * len(row)  # 金色
-                        elif row['排名'] == 2:
-                            return ['background-color: #C0C0C0'] * len(row)  # 银色
-                        elif row['排名'] == 3:
-                            return ['background-color: #CD7F32'] * len(row)  # 铜色
-                        else:
-                            return [''] * len(row)
-                    
-                    styled_ranking = ranking_display.style.apply(highlight_top3, axis=1)
-                    st.dataframe(styled_ranking, use_container_width=True)
-                    
-                    # 排行榜洞察
-                    st.subheader("💡 排行榜洞察")
-                    
-                    insights = []
-                    
-                    if len(community_ranking) > 0:
-                        top1 = community_ranking.iloc[0]
-                        top1_value = top1[sort_col]
-                        
-                        if ranking_metric == "成交量":
-                            insights.append(f"🥇 **{top1['小区名称']}** 以 **{top1_value:.0f}套** 成交量位居榜首，是最受欢迎的小区")
-                            if len(community_ranking) > 1:
-                                avg_volume = community_ranking['成交套数'].mean()
-                                insights.append(f"📊 榜单小区平均成交量为 **{avg_volume:.1f}套**，显示了活跃的交易市场")
-                        
-                        elif ranking_metric == "成交均价":
-                            insights.append(f"🥇 **{top1['小区名称']}** 以 **{top1_value:,.0f}元/㎡** 的均价位居榜首，是区域内的高端小区")
-                            if len(community_ranking) > 1:
-                                price_range = community_ranking['平均单价'].max() - community_ranking['平均单价'].min()
-                                insights.append(f"💰 榜单小区价格差距为 **{price_range:,.0f}元/㎡**，显示了明显的品质分层")
-                        
-                        elif ranking_metric == "成交总价":
-                            insights.append(f"🥇 **{top1['小区名称']}** 以 **{top1_value:.1f}万元** 的均价位居榜首，房源价值最高")
-                            avg_area = top1['平均面积']
-                            insights.append(f"🏠 该小区平均面积为 **{avg_area:.1f}㎡**，属于{'大户型' if avg_area > 100 else '中等户型' if avg_area > 70 else '小户型'}定位")
-                        
-                        elif ranking_metric == "成交周期" and not pd.isna(top1_value):
-                            insights.append(f"🥇 **{top1['小区名称']}** 以 **{top1_value:.0f}天** 的成交周期位居榜首，是最容易成交的小区")
-                            if top1_value <= 30:
-                                insights.append("⚡ 成交周期在30天以内，属于快速成交，说明房源非常抢手")
-                            elif top1_value <= 60:
-                                insights.append("✅ 成交周期在60天以内，属于正常成交速度")
-                    
-                    # 显示洞察
-                    for insight in insights:
-                        st.markdown(insight)
-                    
-                else:
-                    st.warning("没有足够的小区数据进行排行榜分析（需要至少3套成交记录）")
-                    
-            except Exception as e:
-                st.error(f"小区排行榜分析出现错误: {str(e)}")
+            render_community_ranking(filtered_df)
 
         # --- 房源竞争力分析 ---
         if data_type == '在售房源':
             st.markdown("---")
             st.header("🎯 房源竞争力分析")
             
-            # 房源选择器
-            st.subheader("🏠 选择目标房源")
-            
-            # 创建房源选择的显示格式
-            def format_property_display(row):
-                return f"{row['小区']} | {row['户型']} | {row['建筑面积(㎡)']}㎡ | {row['总价(万)']}万 | {row['单价(元/平)']:,.0f}元/㎡"
-            
-            # 为每个房源创建唯一标识
-            filtered_df['房源显示'] = filtered_df.apply(format_property_display, axis=1)
-            filtered_df['房源ID'] = range(len(filtered_df))
-            
-            # 房源选择下拉框
-            selected_property_idx = st.selectbox(
-                "选择要分析的房源：",
-                options=filtered_df['房源ID'].tolist(),
-                format_func=lambda x: filtered_df.loc[filtered_df['房源ID'] == x, '房源显示'].iloc[0],
-                help="选择一套房源进行竞争力分析"
-            )
-            
-            if selected_property_idx is not None:
-                selected_property = filtered_df[filtered_df['房源ID'] == selected_property_idx].iloc[0]
-                
-                # 显示选中房源的详细信息
-                st.subheader("📋 目标房源信息")
-                
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("🏢 小区", selected_property['小区'])
-                    st.metric("🏠 户型", selected_property['户型'])
-                with col2:
-                    st.metric("💰 总价", f"{selected_property['总价(万)']}万")
-                    st.metric("🏷️ 单价", f"{selected_property['单价(元/平)']:,.0f}元/㎡")
-                with col3:
-                    st.metric("📐 面积", f"{selected_property['建筑面积(㎡)']}㎡")
-                    st.metric("🧭 朝向", selected_property['朝向'])
-                with col4:
-                    st.metric("🏢 楼层", selected_property['楼层'])
-                    st.metric("👥 关注度", f"{selected_property['关注人数']}人")
-                
-                # 房源标签展示
-                if '房源标签' in selected_property and pd.notna(selected_property['房源标签']):
-                    st.write("🏷️ **房源标签：**", selected_property['房源标签'])
-                
-                # 竞争力分析
-                st.subheader("⚔️ 竞争力分析")
-                
-                # 定义竞争对手筛选条件
-                competitor_analysis = analyze_property_competitiveness(selected_property, filtered_df)
-                
-                # 显示竞争分析结果
-                display_competitiveness_analysis(competitor_analysis, selected_property)
+            render_property_competitiveness(filtered_df)
 
         # --- 详细数据表格 ---
         st.markdown("---")
         st.header("📋 详细数据查看")
         
-        # 数据表格选项
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            show_all_columns = st.checkbox("显示所有列", value=False)
-        with col2:
-            rows_to_show = st.selectbox("显示行数", [10, 25, 50, 100], index=1)
-        with col3:
-            if st.button("📥 导出数据"):
-                csv = filtered_df.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="下载CSV文件",
-                    data=csv,
-                    file_name=f"{data_type}_分析数据_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv"
-                )
-        
-        # 显示数据表格
-        if show_all_columns:
-            st.dataframe(filtered_df.head(rows_to_show), use_container_width=True)
-        else:
-            # 选择关键列显示
-            key_columns = ['小区名称', '户型', '面积(㎡)', '总价(万)', '单价(元/平)']
-            if data_type == '在售房源':
-                key_columns.extend(['区域', '商圈', '朝向', '装修', '楼层'])
-            else:
-                key_columns.extend(['成交日期', '成交周期(天)', '挂牌价(万)'])
-            
-            available_columns = [col for col in key_columns if col in filtered_df.columns]
-            st.dataframe(filtered_df[available_columns].head(rows_to_show), use_container_width=True)
+        render_detail_table(filtered_df, data_type)
 
         # --- 洞察报告 ---
         st.markdown("---")
         st.header("🎯 市场洞察")
         
+        # 洞察与建议共用的有效数值，每列只去一次空值；缺失或全为空的列直接跳过对应分析
+        valid_values = valid_numeric_values(filtered_df, ('面积(㎡)', '成交周期(天)'))
+        
+        # 洞察与建议共用的近期趋势和平均折价率（仅成交数据），各只取一次
+        trends = None
+        avg_discount = None
+        if data_type == '成交房源':
+            if '成交日期' in filtered_df.columns:
+                try:
+                    # 复用趋势分析中已缓存的时间列，按整数年月键分组
+                    trends = detect_recent_trends(add_time_columns(filtered_df))
+                except:
+                    pass
+            if '挂牌价(万)' in filtered_df.columns and '总价(万)' in filtered_df.columns:
+                discount_rates = calculate_discount_rates(filtered_df[['挂牌价(万)', '总价(万)']])
+                if len(discount_rates) > 0:
+                    avg_discount = discount_rates.mean()
+        
+        # 小户型占比（70㎡及以下）和平均成交周期，洞察与建议共用
+        small_ratio = None
+        if '面积(㎡)' in valid_values:
+            area_data = valid_values['面积(㎡)']
+            small_ratio = np.count_nonzero(area_data <= 70) / len(area_data) * 100
+        avg_cycle = None
+        if '成交周期(天)' in valid_values:
+            avg_cycle = valid_values['成交周期(天)'].mean()
+        
         insights_col1, insights_col2 = st.columns(2)
         
         with insights_col1:
@@ -1951,101 +2478,67 @@ if uploaded_files:
                 if '户型' in df.columns and 'selected_room_types' in locals():
                     if len(selected_room_types) == 1:
                         insights.append(f"🔸 专注分析{selected_room_types[0]}户型，数据更精准")
-                    elif len(selected_room_types) < len(df['户型分类'].unique()):
+                    elif len(selected_room_types) < len(room_types):
                         insights.append(f"🔸 对比分析{len(selected_room_types)}种户型，便于横向比较")
                 
                 # 楼层筛选洞察
                 if floor_col in df.columns and 'selected_floor_types' in locals():
-                    if len(selected_floor_types) == 1:
-                        floor_type = selected_floor_types[0]
-                        if floor_type == '高楼层':
-                            insights.append("🔸 高楼层房源通常视野好、采光佳，但价格相对较高")
-                        elif floor_type == '低楼层':
-                            insights.append("🔸 低楼层房源出行便利，适合老人居住，价格相对实惠")
-                        elif floor_type == '中楼层':
-                            insights.append("🔸 中楼层房源平衡了价格和居住体验，是热门选择")
+                    if len(selected_floor_types) == 1 and selected_floor_types[0] in FLOOR_INSIGHTS:
+                        insights.append(FLOOR_INSIGHTS[selected_floor_types[0]])
                 
                 # 装修筛选洞察
                 if '装修' in df.columns and 'selected_decorations' in locals():
-                    if len(selected_decorations) == 1:
-                        decoration = selected_decorations[0]
-                        if decoration == '精装':
-                            insights.append("🔸 精装房源即买即住，但总价较高，适合追求便利的购房者")
-                        elif decoration == '简装':
-                            insights.append("🔸 简装房源价格适中，可根据个人喜好再装修")
-                        elif decoration == '毛坯':
-                            insights.append("🔸 毛坯房源价格最低，但需要额外装修成本和时间")
+                    if len(selected_decorations) == 1 and selected_decorations[0] in DECORATION_INSIGHTS:
+                        insights.append(DECORATION_INSIGHTS[selected_decorations[0]])
             
             # 价格洞察
             if price_stats:
-                if price_stats['std'] / price_stats['mean'] > 0.3:
+                if price_stats['cv'] > 0.3:
                     insights.append("🔸 市场价格分化明显，存在较大价格差异，投资需谨慎选择区域")
                 else:
                     insights.append("🔸 市场价格相对稳定，价格区间集中，适合稳健投资")
             
             # 面积洞察
-            if '面积(㎡)' in filtered_df.columns:
-                area_data = filtered_df['面积(㎡)'].dropna()
-                if len(area_data) > 0:
-                    small_ratio = len(area_data[area_data <= 70]) / len(area_data) * 100
-                    if small_ratio > 60:
-                        insights.append(f"🔸 小户型占主导地位({small_ratio:.1f}%)，刚需市场活跃，租赁需求旺盛")
-                    elif small_ratio < 30:
-                        insights.append(f"🔸 改善型需求为主({100-small_ratio:.1f}%为大户型)，高端市场活跃")
+            if small_ratio is not None:
+                if small_ratio > 60:
+                    insights.append(f"🔸 小户型占主导地位({small_ratio:.1f}%)，刚需市场活跃，租赁需求旺盛")
+                elif small_ratio < 30:
+                    insights.append(f"🔸 改善型需求为主({100-small_ratio:.1f}%为大户型)，高端市场活跃")
             
             # 时间序列洞察（仅成交数据）
-            if data_type == '成交房源' and '成交日期' in filtered_df.columns:
-                try:
-                    time_data = filtered_df.dropna(subset=['成交日期'])
-                    if len(time_data) > 0:
-                        time_data['年月'] = pd.to_datetime(time_data['成交日期']).dt.to_period('M')
-                        monthly_volume = time_data.groupby('年月').size()
-                        monthly_price = time_data.groupby('年月')['单价(元/平)'].mean()
-                        
-                        if len(monthly_volume) >= 3:
-                            # 成交量趋势分析
-                            recent_volumes = monthly_volume.tail(3).values
-                            if recent_volumes[-1] > recent_volumes[0] * 1.2:
-                                insights.append("🔸 近期成交量呈上升趋势，市场活跃度提升")
-                            elif recent_volumes[-1] < recent_volumes[0] * 0.8:
-                                insights.append("🔸 近期成交量下降，市场观望情绪浓厚")
-                            
-                            # 价格趋势分析
-                            recent_prices = monthly_price.tail(3).values
-                            if len(recent_prices) >= 2:
-                                price_trend = (recent_prices[-1] - recent_prices[0]) / recent_prices[0] * 100
-                                if price_trend > 5:
-                                    insights.append(f"🔸 价格上涨趋势明显({price_trend:.1f}%)，建议尽早入市")
-                                elif price_trend < -5:
-                                    insights.append(f"🔸 价格下跌趋势({price_trend:.1f}%)，可等待更好时机")
-                                else:
-                                    insights.append("🔸 价格相对稳定，市场处于平衡状态")
-                except:
-                    pass
+            if trends is not None:
+                # 成交量趋势分析
+                if trends['volume_trend'] > 0:
+                    insights.append("🔸 近期成交量呈上升趋势，市场活跃度提升")
+                elif trends['volume_trend'] < 0:
+                    insights.append("🔸 近期成交量下降，市场观望情绪浓厚")
+                
+                # 价格趋势分析
+                price_trend = trends['price_trend']
+                if price_trend > 5:
+                    insights.append(f"🔸 价格上涨趋势明显({price_trend:.1f}%)，建议尽早入市")
+                elif price_trend < -5:
+                    insights.append(f"🔸 价格下跌趋势({price_trend:.1f}%)，可等待更好时机")
+                else:
+                    insights.append("🔸 价格相对稳定，市场处于平衡状态")
             
             # 成交周期洞察
-            if data_type == '成交房源' and '成交周期(天)' in filtered_df.columns:
-                cycle_data = filtered_df['成交周期(天)'].dropna()
-                if len(cycle_data) > 0:
-                    fast_ratio = len(cycle_data[cycle_data <= 30]) / len(cycle_data) * 100
-                    avg_cycle = cycle_data.mean()
-                    if fast_ratio > 50:
-                        insights.append(f"🔸 市场活跃度高，{fast_ratio:.1f}%房源30天内成交，卖方市场特征明显")
-                    elif avg_cycle > 90:
-                        insights.append(f"🔸 平均成交周期{avg_cycle:.0f}天，市场消化较慢，买方议价空间大")
-                    else:
-                        insights.append("🔸 成交周期适中，市场供需相对平衡")
+            if data_type == '成交房源' and '成交周期(天)' in valid_values:
+                cycle_data = valid_values['成交周期(天)']
+                fast_ratio = np.count_nonzero(cycle_data <= 30) / len(cycle_data) * 100
+                if fast_ratio > 50:
+                    insights.append(f"🔸 市场活跃度高，{fast_ratio:.1f}%房源30天内成交，卖方市场特征明显")
+                elif avg_cycle > 90:
+                    insights.append(f"🔸 平均成交周期{avg_cycle:.0f}天，市场消化较慢，买方议价空间大")
+                else:
+                    insights.append("🔸 成交周期适中，市场供需相对平衡")
             
             # 折价率洞察
-            if data_type == '成交房源' and '挂牌价(万)' in filtered_df.columns and '总价(万)' in filtered_df.columns:
-                price_data = filtered_df.dropna(subset=['挂牌价(万)', '总价(万)'])
-                if len(price_data) > 0:
-                    discount_rates = (price_data['挂牌价(万)'] - price_data['总价(万)']) / price_data['挂牌价(万)'] * 100
-                    avg_discount = discount_rates.mean()
-                    if avg_discount > 10:
-                        insights.append(f"🔸 平均折价率{avg_discount:.1f}%，买方议价能力强")
-                    elif avg_discount < 5:
-                        insights.append(f"🔸 平均折价率仅{avg_discount:.1f}%，卖方定价权强")
+            if avg_discount is not None:
+                if avg_discount > 10:
+                    insights.append(f"🔸 平均折价率{avg_discount:.1f}%，买方议价能力强")
+                elif avg_discount < 5:
+                    insights.append(f"🔸 平均折价率仅{avg_discount:.1f}%，卖方定价权强")
             
             for insight in insights:
                 st.write(insight)
@@ -2061,41 +2554,30 @@ if uploaded_files:
                 
                 # 户型筛选建议
                 if '户型' in df.columns and 'selected_room_types' in locals():
-                    if '1室' in selected_room_types and len(selected_room_types) == 1:
-                        recommendations.append("🔹 1室户型投资回报率高，适合出租给单身白领")
-                    elif '2室' in selected_room_types and len(selected_room_types) == 1:
-                        recommendations.append("🔹 2室户型需求稳定，适合小家庭和情侣租住")
-                    elif '3室' in selected_room_types and len(selected_room_types) == 1:
-                        recommendations.append("🔹 3室户型适合三口之家，保值性好，转手容易")
+                    if len(selected_room_types) == 1 and selected_room_types[0] in ROOM_RECOMMENDATIONS:
+                        recommendations.append(ROOM_RECOMMENDATIONS[selected_room_types[0]])
                 
                 # 楼层筛选建议
                 if floor_col in df.columns and 'selected_floor_types' in locals():
-                    if '高楼层' in selected_floor_types and len(selected_floor_types) == 1:
-                        recommendations.append("🔹 高楼层房源溢价明显，但要注意电梯维护成本")
-                    elif '低楼层' in selected_floor_types and len(selected_floor_types) == 1:
-                        recommendations.append("🔹 低楼层房源性价比高，适合预算有限的首次购房者")
+                    if len(selected_floor_types) == 1 and selected_floor_types[0] in FLOOR_RECOMMENDATIONS:
+                        recommendations.append(FLOOR_RECOMMENDATIONS[selected_floor_types[0]])
                 
                 # 装修筛选建议
                 if '装修' in df.columns and 'selected_decorations' in locals():
-                    if '毛坯' in selected_decorations and len(selected_decorations) == 1:
-                        recommendations.append("🔹 毛坯房总价低，但需预留10-20万装修预算")
-                    elif '精装' in selected_decorations and len(selected_decorations) == 1:
-                        recommendations.append("🔹 精装房即买即住，适合工作繁忙的购房者")
+                    if len(selected_decorations) == 1 and selected_decorations[0] in DECORATION_RECOMMENDATIONS:
+                        recommendations.append(DECORATION_RECOMMENDATIONS[selected_decorations[0]])
             
             if data_type == '在售房源':
                 # 基于价格分布的建议
-                if price_stats and price_stats['std'] / price_stats['mean'] > 0.3:
+                if price_stats and price_stats['cv'] > 0.3:
                     recommendations.append("🔹 价格分化大，重点关注单价低于市场均价20%的优质房源")
                 
                 # 基于户型分布的建议
-                if '面积(㎡)' in filtered_df.columns:
-                    area_data = filtered_df['面积(㎡)'].dropna()
-                    if len(area_data) > 0:
-                        small_ratio = len(area_data[area_data <= 70]) / len(area_data) * 100
-                        if small_ratio > 60:
-                            recommendations.append("🔹 小户型占主导，适合投资出租，关注地铁沿线和商业区")
-                        else:
-                            recommendations.append("🔹 大户型较多，适合改善性购房，关注学区和环境品质")
+                if small_ratio is not None:
+                    if small_ratio > 60:
+                        recommendations.append("🔹 小户型占主导，适合投资出租，关注地铁沿线和商业区")
+                    else:
+                        recommendations.append("🔹 大户型较多，适合改善性购房，关注学区和环境品质")
                 
                 recommendations.extend([
                     "🔹 关注关注人数高但价格合理的房源，市场认可度高",
@@ -2104,39 +2586,22 @@ if uploaded_files:
             
             else:  # 成交房源
                 # 基于时间趋势的建议
-                try:
-                    if '成交日期' in filtered_df.columns:
-                        time_data = filtered_df.dropna(subset=['成交日期'])
-                        if len(time_data) > 0:
-                            time_data['年月'] = pd.to_datetime(time_data['成交日期']).dt.to_period('M')
-                            monthly_volume = time_data.groupby('年月').size()
-                            
-                            if len(monthly_volume) >= 3:
-                                recent_volumes = monthly_volume.tail(3).values
-                                if recent_volumes[-1] > recent_volumes[0] * 1.2:
-                                    recommendations.append("🔹 成交量上升趋势，建议尽快入市，避免错过机会")
-                                elif recent_volumes[-1] < recent_volumes[0] * 0.8:
-                                    recommendations.append("🔹 成交量下降，可适当等待，寻找更好的议价机会")
-                except:
-                    pass
+                if trends is not None:
+                    if trends['volume_trend'] > 0:
+                        recommendations.append("🔹 成交量上升趋势，建议尽快入市，避免错过机会")
+                    elif trends['volume_trend'] < 0:
+                        recommendations.append("🔹 成交量下降，可适当等待，寻找更好的议价机会")
                 
                 # 基于成交周期的建议
-                if '成交周期(天)' in filtered_df.columns:
-                    cycle_data = filtered_df['成交周期(天)'].dropna()
-                    if len(cycle_data) > 0:
-                        avg_cycle = cycle_data.mean()
-                        if avg_cycle > 90:
-                            recommendations.append("🔹 成交周期较长，买方市场，可适当压价谈判")
-                        else:
-                            recommendations.append("🔹 成交周期较短，市场活跃，定价需贴近市场")
+                if avg_cycle is not None:
+                    if avg_cycle > 90:
+                        recommendations.append("🔹 成交周期较长，买方市场，可适当压价谈判")
+                    else:
+                        recommendations.append("🔹 成交周期较短，市场活跃，定价需贴近市场")
                 
                 # 基于折价率的建议
-                if '挂牌价(万)' in filtered_df.columns and '总价(万)' in filtered_df.columns:
-                    price_data = filtered_df.dropna(subset=['挂牌价(万)', '总价(万)'])
-                    if len(price_data) > 0:
-                        discount_rates = (price_data['挂牌价(万)'] - price_data['总价(万)']) / price_data['挂牌价(万)'] * 100
-                        avg_discount = discount_rates.mean()
-                        recommendations.append(f"🔹 参考平均折价率{avg_discount:.1f}%，合理设定期望价格")
+                if avg_discount is not None:
+                    recommendations.append(f"🔹 参考平均折价率{avg_discount:.1f}%，合理设定期望价格")
                 
                 recommendations.extend([
                     "🔹 关注成交周期短且折价率低的区域，市场热度高",
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from main import to_csv_bytes
+
+
+def test_to_csv_bytes_mixed_type_column():
+    # 不同文件合并后，同一列可能既有数字又有文本
+    df = pd.concat([
+        pd.DataFrame({'发布时间': [20240101, 20240201], '总价(万)': [500.0, 620.5]}),
+        pd.DataFrame({'发布时间': ['3月前'], '总价(万)': [380.0]})
+    ], ignore_index=True)
+
+    data = to_csv_bytes(df)
+
+    assert data.startswith(b'\xef\xbb\xbf')
+    assert data == df.to_csv(index=False).encode('utf-8-sig')
+    assert '3月前' in data.decode('utf-8-sig')
+
+
+def test_to_csv_bytes_writes_dates_without_time():
+    df = pd.DataFrame({'成交日期': pd.to_datetime(['2024-01-01', '2024-02-15']), '总价(万)': [500, 620]})
+
+    lines = to_csv_bytes(df).decode('utf-8-sig').splitlines()
+
+    assert lines[0] == '"成交日期","总价(万)"'
+    assert lines[1:] == ['2024-01-01,500', '2024-02-15,620']
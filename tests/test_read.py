@@ -0,0 +1,27 @@
+import numpy as np
+
+from main import read_csv_file
+
+
+def test_read_csv_file_only_downcasts_price_and_area_columns():
+    # 坐标等其他浮点列保持 float64，不能降为 float32 丢失精度
+    data = '经度,纬度,总价(万),建筑面积(㎡)\n121.4737012345,31.2304123456,500.5,88.2\n121.5,,620,\n'.encode('utf-8')
+
+    df = read_csv_file(data, 'utf-8')
+
+    assert df['经度'].dtype == np.float64
+    assert df['经度'].iloc[0] == 121.4737012345
+    assert df['纬度'].iloc[0] == 31.2304123456
+    assert df['总价(万)'].dtype == np.float32
+    assert df['建筑面积(㎡)'].dtype == np.float32
+
+
+def test_read_csv_file_chunked_fallback_keeps_other_floats():
+    # 重复列名走 pandas 分块读取
+    data = '经度,总价(万),总价(万)\n121.4737012345,500.5,1\n121.5,620,2\n'.encode('utf-8')
+
+    df = read_csv_file(data, 'utf-8')
+
+    assert df['经度'].dtype == np.float64
+    assert df['经度'].iloc[0] == 121.4737012345
+    assert df['总价(万)'].dtype == np.float32